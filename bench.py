@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import contextlib
+import glob
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import discord
+
+# Микробенчмарки отдельных узлов bot.py без Discord. Пример:
+#   python bench.py scheduler --sizes 10000 100000 1000000
+#   python bench.py sqlite --writes 5000
+#   python bench.py views --openings 100000
+#   python bench.py snapshots --snapshot-timers 200000 --changed 0.01
+
+# bot.py при импорте сразу вызывает bot.run — шлюза здесь нет
+discord.Client.run = lambda self, *args, **kwargs: None
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def per_op(started, count):
+    return (time.perf_counter() - started) / count * 1e6
+
+def clear_notifications():
+    # Окно планировщика читает таблицу целиком — прошлые прогоны не должны в него попасть
+    bot_module.db_writer.execute("DELETE FROM notifications")
+    bot_module.db_writer.flush()
+
+
+async def bench_scheduler(args):
+    # Куча напоминаний: вставка, пустой тик, ленивая отмена и срабатывание пачки
+    for size in args.sizes:
+        clear_notifications()
+        scheduler = bot_module.NotificationScheduler()
+        now = time.time()
+        await scheduler._advance_window(now)
+        window = bot_module.NOTIFY_WINDOW
+
+        started = time.perf_counter()
+        for user_id in range(size):
+            scheduler.add(user_id, "Схемы", now + random.uniform(1, window))
+        add_us = per_op(started, size)
+
+        bot_module.db_writer.flush()
+        started = time.perf_counter()
+        for _ in range(1000):
+            scheduler.pop_due(now)
+        idle_us = per_op(started, 1000)
+
+        cancelled = range(0, size, 10)
+        started = time.perf_counter()
+        for user_id in cancelled:
+            scheduler.cancel(user_id, "Схемы")
+        cancel_us = per_op(started, len(cancelled))
+
+        started = time.perf_counter()
+        due = scheduler.pop_due(now + 60)
+        fire_ms = (time.perf_counter() - started) * 1000
+
+        print(
+            f"{size:>9} напоминаний: вставка {add_us:.2f} мкс, пустой тик {idle_us:.1f} мкс, "
+            f"отмена {cancel_us:.2f} мкс, срабатывание {len(due)} шт. за {fire_ms:.2f} мс"
+        )
+
+    # Задержка срабатывания: сколько проходит от end_time до выдачи из pop_due
+    clear_notifications()
+    scheduler = bot_module.NotificationScheduler()
+    latencies = []
+
+    async def loop():
+        while True:
+            await scheduler.wait()
+            for notify in scheduler.pop_due(time.time()):
+                latencies.append(time.time() - notify["end_time"])
+
+    task = asyncio.create_task(loop())
+    await asyncio.sleep(0)
+    for user_id in range(args.fired):
+        scheduler.add(user_id, "Схемы", time.time() + random.uniform(0.01, 0.5))
+    await asyncio.sleep(0.7)
+    task.cancel()
+
+    latencies.sort()
+    print(
+        f"Задержка срабатывания ({len(latencies)} шт.): p50 {latencies[len(latencies) // 2] * 1000:.2f} мс, "
+        f"p99 {latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000:.2f} мс"
+    )
+
+
+def connect_bench_db(path, tuned):
+    # tuned — соединение как у бота (connect_db), иначе настройки sqlite3 по умолчанию
+    if not tuned:
+        return sqlite3.connect(path)
+    db_path, bot_module.DB_PATH = bot_module.DB_PATH, path
+    try:
+        return bot_module.connect_db()
+    finally:
+        bot_module.DB_PATH = db_path
+
+async def bench_sqlite(args):
+    # Запись с коммитом на каждую строку (как было до DBWriter) и точечное чтение
+    for title, tuned in (("журнал отката, по умолчанию", False), ("WAL + synchronous=NORMAL", True)):
+        path = f"bench-{int(tuned)}.db"
+        with contextlib.closing(connect_bench_db(path, tuned)) as db:
+            db.execute('''
+                CREATE TABLE timers (
+                    user_id INTEGER, action_name TEXT, started_at REAL, end_time REAL,
+                    PRIMARY KEY (user_id, action_name)
+                )
+            ''')
+            db.commit()
+
+            started = time.perf_counter()
+            for user_id in range(args.writes):
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO timers VALUES (?, ?, ?, ?)",
+                        (user_id, "Схемы", time.time(), time.time() + 3600)
+                    )
+            writes = args.writes / (time.perf_counter() - started)
+
+            started = time.perf_counter()
+            for _ in range(args.reads):
+                db.execute(
+                    "SELECT end_time FROM timers WHERE user_id = ? AND action_name = ?",
+                    (random.randrange(args.writes), "Схемы")
+                ).fetchone()
+            reads = args.reads / (time.perf_counter() - started)
+
+        print(f"{title:<28} {writes:>9.0f} записей/с  {reads:>9.0f} чтений/с")
+
+
+async def bench_views(args):
+    # Открытия меню против ViewStore discord.py: отправка сообщения с view
+    # сохраняет её в хранилище, если она не остановлена (см. Messageable.send)
+    catalog = bot_module.get_catalog()
+    variants = (
+        ("новое меню на каждое открытие", lambda: bot_module.MENU_VIEWS["farm"](catalog)),
+        ("общая остановленная разметка", lambda: catalog.view("farm")),
+    )
+    for title, make_view in variants:
+        store = discord.ui.view.ViewStore(bot_module.bot._connection)
+        tracemalloc.start()
+        started = time.perf_counter()
+        for message_id in range(args.openings):
+            view = make_view()
+            if not view.is_finished() and view.is_dispatchable():
+                store.add_view(view, message_id)
+        elapsed = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        stored = {item.view.id for items in store._views.values() for item in items.values()}
+        print(
+            f"{title:<30} {args.openings} открытий: во ViewStore {len(stored)} view, "
+            f"{memory / 2 ** 20:.1f} МБ, {elapsed:.2f} с"
+        )
+
+
+def timer_rows(db):
+    return sorted(db.execute("SELECT user_id, action, last_used, end_time, kind FROM user_timers").fetchall())
+
+async def bench_snapshots(args):
+    # Полный снимок против дельты, когда изменилась малая доля таймеров, и
+    # восстановление основа + дельта против состояния базы на момент дельты
+    catalog_names = list(bot_module.get_catalog().actions)
+    now = time.time()
+    bot_module.db_writer.execute("DELETE FROM user_timers")
+    clear_notifications()
+    users = max(1, args.snapshot_timers // len(catalog_names))
+    for i in range(args.snapshot_timers):
+        record = bot_module.timer_store.start(i % users, catalog_names[i // users % len(catalog_names)], now, 3600 + i % 3600)
+        bot_module.save_timer_to_db(record)
+        bot_module.notification_scheduler.add(record.user_id, record.action_name, record.end_time)
+    bot_module.db_writer.flush()
+
+    started = time.perf_counter()
+    print(bot_module.make_snapshot(bot_module.snapshot_changes()))
+    full_ms = (time.perf_counter() - started) * 1000
+
+    # Доля игроков перезапускает таймер, столько же снимают его вручную
+    changed = int(args.snapshot_timers * args.changed)
+    for i in random.sample(range(args.snapshot_timers), changed):
+        user_id, action_name = i % users, catalog_names[i // users % len(catalog_names)]
+        if i % 2:
+            record = bot_module.timer_store.start(user_id, action_name, now + 60, 7200)
+            bot_module.save_timer_to_db(record)
+            bot_module.notification_scheduler.add(user_id, action_name, record.end_time)
+        elif bot_module.timer_store.remove(user_id, action_name):
+            bot_module.delete_timer_from_db(user_id, action_name)
+            bot_module.notification_scheduler.cancel(user_id, action_name)
+    bot_module.db_writer.flush()
+
+    started = time.perf_counter()
+    print(bot_module.make_snapshot(bot_module.snapshot_changes()))
+    delta_ms = (time.perf_counter() - started) * 1000
+    with bot_module.read_pool.connection() as db:
+        expected = timer_rows(db)
+
+    (delta_path,) = glob.glob(os.path.join(bot_module.SNAPSHOT_DIR, "*.delta"))
+    started = time.perf_counter()
+    snapshot, delta = bot_module.read_snapshot_with_base(delta_path)
+    bot_module.restore_snapshot_to_db(snapshot, delta)
+    bot_module.restore_snapshot_to_memory(snapshot, delta)
+    bot_module.db_writer.flush()
+    restore_ms = (time.perf_counter() - started) * 1000
+    with bot_module.read_pool.connection() as db:
+        restored = timer_rows(db)
+    in_memory = sum(1 for user_id, action, *_ in expected if bot_module.timer_store.get(user_id, action))
+
+    print(
+        f"{args.snapshot_timers} таймеров, изменено {changed}: полный снимок {full_ms:.0f} мс, "
+        f"дельта {delta_ms:.0f} мс, восстановление основа+дельта {restore_ms:.0f} мс, "
+        f"база {'совпала' if restored == expected else 'НЕ совпала'}, "
+        f"в памяти {in_memory} из {len(expected)}"
+    )
+
+
+BENCHMARKS = {
+    "scheduler": bench_scheduler,
+    "sqlite": bench_sqlite,
+    "views": bench_views,
+    "snapshots": bench_snapshots,
+}
+
+
+async def main(args):
+    bot_module.init_db()
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"--- {name} ---")
+        await BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Микробенчмарки узлов бота")
+    parser.add_argument("benchmarks", nargs="*", help=f"из {', '.join(BENCHMARKS)}; по умолчанию — все")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="размеры для scheduler")
+    parser.add_argument("--fired", type=int, default=200, help="напоминаний для замера задержки срабатывания")
+    parser.add_argument("--writes", type=int, default=2000, help="записей с коммитом для sqlite")
+    parser.add_argument("--reads", type=int, default=100000, help="точечных чтений для sqlite")
+    parser.add_argument("--openings", type=int, default=10000, help="открытий меню для views")
+    parser.add_argument("--snapshot-timers", type=int, default=100000, help="таймеров для snapshots")
+    parser.add_argument("--changed", type=float, default=0.01, help="доля изменённых таймеров для дельты в snapshots")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"неизвестные бенчмарки: {', '.join(unknown)}")
+    random.seed(args.seed)
+
+    # Своя база и копия каталога во временной папке — боевая farm_bot.db не трогается
+    workdir = tempfile.mkdtemp(prefix="farm-bot-bench-")
+    shutil.copy(os.path.join(BOT_DIR, "actions.json"), workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, BOT_DIR)
+    import bot as bot_module
+
+    try:
+        asyncio.run(main(args))
+    finally:
+        bot_module.db_writer.close()
+        shutil.rmtree(workdir, ignore_errors=True)
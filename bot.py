@@ -4,190 +4,2670 @@ import time
 import asyncio
 import sqlite3
 import os
+import heapq
+import itertools
+import threading
+import queue
+import collections
+import atexit
+import signal
+import contextlib
+import random
+import array
+import hashlib
+import json
+import enum
+import logging
+import re
+import glob
+import functools
+import socket
+import bisect
+import sys
+import mmap
+import struct
 
 # --- Discord ---
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = discord.Client(intents=intents)
+# --- Шардирование ---
+# BOT_SHARD_COUNT — всего шардов, BOT_SHARD_IDS — какие из них поднимает этот процесс
+# (например "0,1"). Процессы с разными BOT_SHARD_IDS делят одну базу DB_PATH.
+SHARD_COUNT = int(os.getenv("BOT_SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("BOT_SHARD_IDS", "").split(",") if shard_id.strip()] or None
+WORKER_ID = os.getenv("BOT_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+MULTI_PROCESS = SHARD_IDS is not None
+
+if SHARD_COUNT or SHARD_IDS:
+    bot = discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = discord.Client(intents=intents)
 tree = app_commands.CommandTree(bot)
 
-# --- Настройки кулдаунов ---
-custom_cooldowns = {
-    "Схемы": 14400,
-    "Швейка": 14400,
-    "Волонтёрка": 10800,
-    "Скользкая": 10800,
-    "Питомец": 900,
-    "Организация": 7200,
-    "Релог": 900,
-
-    # Задания клуба
-    "Moto": 7200,
-    "Car Meet": 7200,
-    "Rednecks": 7200,
-    "The Epsilon Program": 7200,
-    "Merryweather": 7200,
-
-    # Оплата имущества
-    "Оплата на 6 дней": 5 * 86400,
-    "Оплата на 29 дней": 29 * 86400
-}
+# --- Метрики ---
+# BOT_METRICS=1 включает сбор; без него декораторы возвращают функции как есть,
+# а остальные точки замера — одна проверка флага.
+METRICS_ENABLED = os.getenv("BOT_METRICS") == "1"
+METRICS_HOST = os.getenv("BOT_METRICS_HOST", "127.0.0.1")
+# Процессы одной машины не должны делить порт: по умолчанию сдвигаем его на первый шард
+METRICS_PORT = int(os.getenv("BOT_METRICS_PORT") or 9108 + (SHARD_IDS[0] if SHARD_IDS else 0))
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_LOOP_LAG_INTERVAL = 0.5  # как часто меряем задержку цикла событий
+PROFILER_INTERVAL = 0.01  # период выборки стека профилировщиком, секунды
+PROFILER_DEPTH = 12  # сколько кадров стека учитываем
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Верхняя граница корзины, куда попал квантиль — для сводки достаточно
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.counters = collections.Counter()  # (имя, метки) -> значение
+        self.histograms = {}  # (имя, метки) -> Histogram
+        self.gauges = {}  # имя -> функция без аргументов
+
+    def inc(self, name, value=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    def timed(self, handler):
+        # Декоратор для корутин-обработчиков; при выключенных метриках ничего не оборачивает
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    self.inc("farm_bot_handler_errors_total", handler=handler)
+                    raise
+                finally:
+                    self.observe("farm_bot_handler_seconds", time.perf_counter() - started, handler=handler)
+            return wrapper
+        return decorator
+
+    def render(self):
+        # Текстовый формат Prometheus
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        for name, func in sorted(self.gauges.items()):
+            try:
+                lines.append(f"{name} {func()}")
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class SamplingProfiler:
+    # Раз в PROFILER_INTERVAL снимает стек главного потока и считает одинаковые стеки.
+    # Включается командой /метрики, в обычной работе поток не запущен.
+    def __init__(self):
+        self.samples = collections.Counter()
+        self._target = threading.main_thread().ident
+        self._thread = None
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self.samples.clear()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread = None
+
+    def _run(self):
+        while self._running:
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None and len(stack) < PROFILER_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(PROFILER_INTERVAL)
+
+    def top(self, limit=10):
+        total = sum(self.samples.values())
+        return [(stack, count / total) for stack, count in self.samples.most_common(limit)] if total else []
+
+
+metrics = Metrics(METRICS_ENABLED)
+profiler = SamplingProfiler()
+
+
+class RateLimitCounter(logging.Handler):
+    # discord.py сам повторяет запросы после 429 и только пишет предупреждение в лог.
+    # marker — кусок этого предупреждения: у REST бота и у вебхуков он разный
+    def __init__(self, client, marker):
+        super().__init__()
+        self.client = client
+        self.marker = marker
+
+    def emit(self, record):
+        if record.levelno >= logging.WARNING and self.marker in record.getMessage():
+            metrics.inc("farm_bot_discord_429_total", client=self.client)
+
+
+def instrument_discord_http():
+    request = bot.http.request
+
+    async def counted_request(route, **kwargs):
+        metrics.inc("farm_bot_discord_requests_total", client="http", method=route.method)
+        return await request(route, **kwargs)
+
+    bot.http.request = counted_request
+    logging.getLogger("discord.http").addHandler(RateLimitCounter("http", "429"))
 
+    # Ответы на взаимодействия, followup и edit_original_response идут мимо
+    # bot.http — через общий адаптер вебхуков, а это основная часть REST бота
+    adapter = discord.webhook.async_.async_context.get()
+    webhook_request = adapter.request
+
+    async def counted_webhook_request(route, *args, **kwargs):
+        metrics.inc("farm_bot_discord_requests_total", client="webhook", method=route.method)
+        return await webhook_request(route, *args, **kwargs)
+
+    adapter.request = counted_webhook_request
+    logging.getLogger("discord.webhook.async_").addHandler(RateLimitCounter("webhook", "is rate limited"))
+
+async def watch_loop_lag():
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(METRICS_LOOP_LAG_INTERVAL)
+        metrics.observe("farm_bot_event_loop_lag_seconds", time.perf_counter() - started - METRICS_LOOP_LAG_INTERVAL)
+
+async def handle_metrics_request(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else "/"
+        if path == "/metrics":
+            status, body = "200 OK", metrics.render()
+        elif path == "/profile":
+            status, body = "200 OK", "".join(f"{share:.1%} {stack}\n" for stack, share in profiler.top(50))
+        else:
+            status, body = "404 Not Found", "not found\n"
+
+        payload = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+def register_gauges():
+    metrics.gauge("farm_bot_timers", lambda: len(timer_store))
+    metrics.gauge("farm_bot_notifications_scheduled", lambda: len(notification_scheduler))
+    metrics.gauge("farm_bot_dm_queue_depth", lambda: dm_pipeline._queue.qsize())
+    metrics.gauge("farm_bot_dm_planned", dm_pipeline.planned)
+    metrics.gauge("farm_bot_dm_sent", lambda: dm_pipeline.sent)
+    metrics.gauge("farm_bot_dm_failed", lambda: dm_pipeline.failed)
+    metrics.gauge("farm_bot_dm_retries", lambda: dm_pipeline.retries)
+    for p in (50, 90, 99):
+        metrics.gauge(f"farm_bot_dm_latency_p{p}_seconds", functools.partial(dm_pipeline.latency_percentile, p))
+    metrics.gauge("farm_bot_db_write_queue_depth", db_writer.pending)
+    metrics.gauge("farm_bot_db_write_errors", lambda: db_writer.errors)
+    metrics.gauge("farm_bot_db_write_batches", lambda: db_writer.batches)
+    metrics.gauge("farm_bot_db_write_operations", lambda: db_writer.operations)
+    metrics.gauge("farm_bot_compactor_timers_evicted", lambda: timer_compactor.timers_evicted)
+    metrics.gauge("farm_bot_compactor_rows_deleted", lambda: timer_compactor.rows_deleted)
+    metrics.gauge("farm_bot_compactor_bytes_reclaimed", lambda: timer_compactor.bytes_reclaimed)
+    metrics.gauge("farm_bot_event_partitions_dropped", lambda: event_log.dropped_partitions)
+    metrics.gauge("farm_bot_event_buffer", lambda: len(event_log._buffer))
+    metrics.gauge("farm_bot_countdowns", lambda: len(countdown_ticker))
+    metrics.gauge("farm_bot_countdown_skipped_edits", lambda: countdown_ticker.skipped)
+    metrics.gauge("farm_bot_countdown_deferred_edits", lambda: countdown_ticker.deferred)
+    metrics.gauge("farm_bot_countdown_evicted", lambda: countdown_ticker.evicted)
+    metrics.gauge("farm_bot_rate_limited_user", lambda: user_limiter.rejected)
+    metrics.gauge("farm_bot_rate_limited_channel", lambda: channel_limiter.rejected)
+    metrics.gauge("farm_bot_rate_limited_global", lambda: global_rejected)
+    metrics.gauge("farm_bot_rate_limit_buckets", lambda: len(user_limiter) + len(channel_limiter))
+    metrics.gauge("farm_bot_ui_refresh_tasks", countdown_ticker.tasks)
+    metrics.gauge("farm_bot_ui_refresh_started", lambda: countdown_ticker._refreshes.started)
+    metrics.gauge("farm_bot_ui_refresh_cancelled", lambda: countdown_ticker._refreshes.cancelled)
+    metrics.gauge("farm_bot_ui_refresh_timed_out", lambda: countdown_ticker._refreshes.timed_out)
+    metrics.gauge("farm_bot_ui_refresh_failed", lambda: countdown_ticker._refreshes.failed)
+    metrics.gauge("farm_bot_timer_list_renders", lambda: timer_renderer.renders)
+    metrics.gauge("farm_bot_timer_list_cache_hits", lambda: timer_renderer.hits)
+
+async def start_metrics():
+    # Только на localhost: снаружи метрики забирает агент на той же машине
+    register_gauges()
+    instrument_discord_http()
+    asyncio.create_task(watch_loop_lag())
+    try:
+        await asyncio.start_server(handle_metrics_request, METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        # Бот работает и без эндпоинта: метрики остаются доступны через /метрики
+        print(f"[Ошибка] Не удалось открыть порт метрик {METRICS_HOST}:{METRICS_PORT}: {e}")
+        return
+    print(f"Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+# --- Каталог действий ---
+ACTIONS_PATH = "actions.json"
 COOLDOWN_DEFAULT = 1800  # 30 минут
 
+MENU_START_MESSAGES = {
+    "farm": "✅ Вы начали: **{name}**",
+    "club": "✅ Вы начали задание: **{name}**",
+    "payment": "✅ Вы начали: **{name}**"
+}
+
+Action = collections.namedtuple(
+    "Action", "name label emoji style menu cooldown start_message notify_message"
+)
+
+
+class ActionCatalog:
+    # Одно описание действий на всё: кнопки меню, кулдауны, тексты уведомлений
+    def __init__(self, entries, guild_id=None):
+        self.guild_id = guild_id
+        self.actions = {}
+        self.menus = collections.defaultdict(list)
+        self._views = {}
+        for entry in entries:
+            name = entry["name"]
+            menu = entry["menu"]
+            if menu not in MENU_START_MESSAGES:
+                raise ValueError(f"Неизвестное меню \"{menu}\" у действия \"{name}\"")
+            if name in self.actions:
+                raise ValueError(f"Действие \"{name}\" описано дважды")
+            action = Action(
+                name=name,
+                label=entry.get("label", name),
+                emoji=entry.get("emoji"),
+                style=ButtonStyle[entry.get("style", "primary")],
+                menu=menu,
+                cooldown=int(entry["cooldown"]),
+                start_message=entry.get("start_message", MENU_START_MESSAGES[menu]).format(name=name),
+                notify_message=entry.get("notify_message", f"🔔 Задание \"{name}\" снова доступно!")
+            )
+            self.actions[name] = action
+            self.menus[menu].append(action)
+
+    @classmethod
+    def from_file(cls, path, guild_id=None):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["actions"], guild_id)
+
+    def cooldown(self, action_name):
+        action = self.actions.get(action_name)
+        return action.cooldown if action else COOLDOWN_DEFAULT
+
+    def custom_id(self, suffix):
+        # У переопределённых каталогов свои кнопки, поэтому в custom_id есть сервер
+        return f"catalog:{self.guild_id or 0}:{suffix}"
+
+    def view(self, menu):
+        # Меню без состояния — собираем разметку один раз на каталог и переиспользуем
+        view = self._views.get(menu)
+        if view is None:
+            view = self._views[menu] = MENU_VIEWS[menu](self).as_layout()
+        return view
+
+
+# guild_id -> каталог; None — каталог по умолчанию из actions.json,
+# серверу можно переопределить его файлом actions.<guild_id>.json
+catalogs = {None: ActionCatalog.from_file(ACTIONS_PATH)}
+
+
+def get_catalog(guild_id=None):
+    return catalogs.get(guild_id) or catalogs[None]
+
+
+def load_catalogs():
+    global catalogs
+    loaded = {None: ActionCatalog.from_file(ACTIONS_PATH)}
+    root, ext = os.path.splitext(ACTIONS_PATH)
+    for path in glob.glob(f"{root}.*{ext}"):
+        guild_id = os.path.basename(path)[len(os.path.basename(root)) + 1:-len(ext)]
+        if guild_id.isdigit():
+            loaded[int(guild_id)] = ActionCatalog.from_file(path, int(guild_id))
+    # Подменяем целиком: открытые меню дорабатывают на старом каталоге
+    catalogs = loaded
+    return loaded
+
+
+def load_guild_catalog(guild_id):
+    # Только переопределение одного сервера: каталог по умолчанию и чужие не трогаем.
+    # Файла нет — сервер возвращается к каталогу по умолчанию
+    global catalogs
+    root, ext = os.path.splitext(ACTIONS_PATH)
+    path = f"{root}.{guild_id}{ext}"
+    loaded = dict(catalogs)
+    if os.path.exists(path):
+        loaded[guild_id] = ActionCatalog.from_file(path, guild_id)
+    else:
+        loaded.pop(guild_id, None)
+    catalogs = loaded
+    return get_catalog(guild_id)
+
+
 def get_cooldown(action_name):
-    return custom_cooldowns.get(action_name, COOLDOWN_DEFAULT)
+    return get_catalog().cooldown(action_name)
+
+
+class TimerKind(enum.IntEnum):
+    CATALOG = 0  # действие из каталога actions.json
+    CUSTOM = 1  # кастомный таймер, длительность задаёт игрок
+
+
+CUSTOM_TIMER_NAME = re.compile(r"Кастомный таймер \((\d+) дн (\d+) ч (\d+) мин\)")
+
+
+def custom_timer_name(days, hours, minutes):
+    return f"Кастомный таймер ({days} дн {hours} ч {minutes} мин)"
+
+def timer_duration_from_name(action_name):
+    # Только для миграции старых строк, где длительность жила в названии
+    match = CUSTOM_TIMER_NAME.fullmatch(action_name)
+    if match:
+        d, h, m = map(int, match.groups())
+        return d * 86400 + h * 3600 + m * 60, TimerKind.CUSTOM
+    return get_cooldown(action_name), TimerKind.CATALOG
 
 # --- SQLite ---
-conn = sqlite3.connect('farm_bot.db', check_same_thread=False)
-cursor = conn.cursor()
+DB_PATH = 'farm_bot.db'
+DB_CACHE_KB = 16384  # размер страничного кэша на соединение
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHED_STATEMENTS = 256  # подготовленные запросы, которые sqlite3 держит скомпилированными
+DB_BUSY_TIMEOUT_MS = 5000
+DB_READ_POOL_SIZE = 4
+DB_IN_CHUNK = 400  # ключей в одном IN (...), с запасом до лимита параметров SQLite
+
+
+def connect_db(readonly=False):
+    db = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+    # auto_vacuum действует, только пока в файле нет ни одной страницы: переход
+    # в WAL уже записывает заголовок, поэтому прагма идёт первой. На старой базе
+    # это пустая операция — её переводит первый VACUUM компактора
+    db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+    db.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    db.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    db.execute("PRAGMA temp_store=MEMORY")
+    if readonly:
+        db.execute("PRAGMA query_only=ON")
+    return db
+
+
+class ReadPool:
+    # Небольшой пул соединений только для чтения. В WAL читатели не ждут
+    # писателя, поэтому выборки и отчёты не мешают DBWriter.
+    def __init__(self, size):
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        started = time.perf_counter() if metrics.enabled else None
+        db = self._acquire()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            self._idle.put(db)
+            if started is not None:
+                metrics.observe("farm_bot_db_seconds", time.perf_counter() - started, op="read")
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self._size:
+                self._created += 1
+                return connect_db(readonly=True)
+        return self._idle.get()
+
+
+read_pool = ReadPool(DB_READ_POOL_SIZE)
+
+# --- Отложенная запись в БД ---
+DB_BATCH_SIZE = 500  # максимум операций в одной транзакции
+DB_FLUSH_INTERVAL = 0.05  # сколько секунд копим пачку перед коммитом
+
+
+class DBWriter:
+    # Отдельный поток со своим соединением: обработчики только кладут
+    # операции в очередь, а поток коммитит их пачками в одной транзакции.
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batches = 0
+        self.operations = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def execute(self, sql, params=()):
+        self._queue.put((sql, params, "one"))
+
+    def executemany(self, sql, seq_of_params):
+        self._queue.put((sql, list(seq_of_params), "many"))
+
+    def maintenance(self, sql):
+        # VACUUM и прагмы обслуживания: выполняются вне транзакции пачки
+        self._queue.put((sql, (), "maintenance"))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        # Блокирует вызывающего до коммита всего, что уже в очереди
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        # Хук на завершение: дописываем очередь и останавливаем поток
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + DB_FLUSH_INTERVAL
+        while len(batch) < DB_BATCH_SIZE and isinstance(batch[-1], tuple):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        writer_conn = connect_db()
+        running = True
+        while running:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            waiters = []
+            count = 0
+
+            with writer_conn:
+                for item in batch:
+                    if item is None:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        sql, params, mode = item
+                        try:
+                            if mode == "many":
+                                writer_conn.executemany(sql, params)
+                            elif mode == "maintenance":
+                                writer_conn.commit()
+                                writer_conn.execute(sql).fetchall()
+                            else:
+                                writer_conn.execute(sql, params)
+                            count += 1
+                        except sqlite3.Error as e:
+                            self.errors += 1
+                            print(f"[Ошибка] Не удалось записать в БД: {e}")
+
+            if count:
+                self.batches += 1
+                self.operations += count
+                if metrics.enabled:
+                    metrics.observe("farm_bot_db_seconds", time.perf_counter() - started, op="write_batch")
+            for waiter in waiters:
+                waiter.set()
+
+        writer_conn.close()
+
+
+db_writer = DBWriter()
+db_writer.start()
+atexit.register(db_writer.close)
 
 def init_db():
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_timers (
-            user_id INTEGER,
-            action TEXT,
-            last_used REAL,
-            PRIMARY KEY (user_id, action)
+    with contextlib.closing(connect_db()) as db:
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS user_timers (
+                user_id INTEGER,
+                action TEXT,
+                last_used REAL,
+                duration REAL,
+                end_time REAL,
+                kind INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, action)
+            )
+        ''')
+        migrate_user_timers(db)
+
+        # Старый журнал: больше не пополняется, события пишутся в events_ГГГГММДД
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                event_type TEXT,
+                user_id INTEGER,
+                action_name TEXT,
+                message TEXT
+            )
+        ''')
+
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS notifications (
+                user_id INTEGER,
+                action_name TEXT,
+                end_time REAL,
+                owner TEXT,
+                lease_until REAL,
+                guild_id INTEGER,
+                PRIMARY KEY (user_id, action_name)
+            )
+        ''')
+        migrate_notifications(db)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_notifications_end_time ON notifications (end_time)")
+
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS guild_settings (
+                guild_id INTEGER PRIMARY KEY,
+                timer_mode TEXT
+            )
+        ''')
+
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS user_presets (
+                user_id INTEGER PRIMARY KEY,
+                actions TEXT
+            )
+        ''')
+
+        # Повторы и цепочки: что заводить, когда таймер игрока истёк
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS timer_routines (
+                user_id INTEGER,
+                action_name TEXT,
+                repeat INTEGER DEFAULT 0,
+                next_action TEXT,
+                guild_id INTEGER,
+                PRIMARY KEY (user_id, action_name)
+            )
+        ''')
+
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS delivery_settings (
+                user_id INTEGER PRIMARY KEY,
+                mode TEXT,
+                digest_minutes INTEGER,
+                quiet_start INTEGER,
+                quiet_end INTEGER,
+                utc_offset INTEGER
+            )
+        ''')
+
+        # Сводки журнала для /статистика и /топ, пополняются при сбросе событий.
+        # Сводки без сервера откладываются и переезжают в новые таблицы ниже
+        legacy_stats = [table for table in STATS_LEGACY_COLUMNS if not has_guild_column(db, table)]
+        for table in legacy_stats:
+            db.execute(f"DROP INDEX IF EXISTS idx_{table}_day")
+            db.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS stats_daily (
+                user_id INTEGER,
+                day INTEGER,
+                action_name TEXT,
+                guild_id INTEGER,
+                count INTEGER,
+                PRIMARY KEY (user_id, day, action_name, guild_id)
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS stats_hourly (
+                guild_id INTEGER,
+                hour INTEGER,
+                action_name TEXT,
+                count INTEGER,
+                PRIMARY KEY (guild_id, hour, action_name)
+            )
+        ''')
+        migrate_stats(db, legacy_stats)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_stats_daily_day ON stats_daily (day)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_stats_daily_guild ON stats_daily (guild_id, day)")
+        migrate_event_partitions(db)
+        db.execute("DROP INDEX IF EXISTS idx_user_timers_last_used")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_user_timers_end_time ON user_timers (end_time)")
+        db.commit()
+
+def migrate_user_timers(db):
+    # Старая схема: только last_used, длительность бралась из названия действия
+    columns = {row[1] for row in db.execute("PRAGMA table_info(user_timers)")}
+    if "end_time" in columns:
+        return
+
+    db.execute("ALTER TABLE user_timers ADD COLUMN duration REAL")
+    db.execute("ALTER TABLE user_timers ADD COLUMN end_time REAL")
+    db.execute("ALTER TABLE user_timers ADD COLUMN kind INTEGER DEFAULT 0")
+
+    updates = []
+    for rowid, action, timestamp in db.execute("SELECT rowid, action, last_used FROM user_timers").fetchall():
+        duration, kind = timer_duration_from_name(action)
+        updates.append((duration, timestamp + duration, int(kind), rowid))
+    db.executemany("UPDATE user_timers SET duration = ?, end_time = ?, kind = ? WHERE rowid = ?", updates)
+
+def migrate_notifications(db):
+    columns = {row[1] for row in db.execute("PRAGMA table_info(notifications)")}
+    # Аренда уведомлений для режима с несколькими процессами
+    if "lease_until" not in columns:
+        db.execute("ALTER TABLE notifications ADD COLUMN owner TEXT")
+        db.execute("ALTER TABLE notifications ADD COLUMN lease_until REAL")
+    # Сервер, чей каталог даёт текст уведомления; у старых строк — каталог по умолчанию
+    if "guild_id" not in columns:
+        db.execute("ALTER TABLE notifications ADD COLUMN guild_id INTEGER")
+
+def has_guild_column(db, table):
+    columns = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    return not columns or "guild_id" in columns
+
+def migrate_stats(db, legacy_stats):
+    # Сводки до разбивки по серверам: чей это был сервер, журнал не знал,
+    # поэтому строки уходят под STATS_NO_GUILD и в /топ не попадают
+    for table in legacy_stats:
+        columns = STATS_LEGACY_COLUMNS[table]
+        db.execute(
+            f"INSERT INTO {table} (guild_id, {columns}) SELECT ?, {columns} FROM {table}_legacy",
+            (STATS_NO_GUILD,)
         )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            event_type TEXT,
-            user_id INTEGER,
-            action_name TEXT,
-            message TEXT
+        db.execute(f"DROP TABLE {table}_legacy")
+
+def migrate_event_partitions(db):
+    # Суточные таблицы журнала, созданные до колонки сервера
+    tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'events_%'").fetchall()
+    for table, in tables:
+        if not has_guild_column(db, table):
+            db.execute(f"ALTER TABLE {table} ADD COLUMN guild_id INTEGER")
+
+def load_settings_from_db():
+    with read_pool.connection() as db:
+        settings = db.execute("SELECT guild_id, timer_mode FROM guild_settings").fetchall()
+
+    for guild_id, timer_mode in settings:
+        guild_timer_modes[guild_id] = timer_mode
+
+# --- Загрузка таймеров ---
+TIMER_LOAD_CHUNK = 5000  # строк за один проход, между проходами отдаём управление циклу
+
+timers_loaded = False
+preloaded_users = set()  # игроки, загруженные точечно, пока идёт фоновая загрузка
+
+
+def start_timer_from_row(user_id, action, timestamp, duration, kind):
+    timer_store.start(user_id, action, timestamp, duration, TimerKind(kind))
+
+async def load_data_from_db():
+    # Только неистёкшие таймеры и частями, чтобы бот отвечал уже во время загрузки
+    global timers_loaded
+    now = time.time()
+
+    with read_pool.connection() as db:
+        rows = db.execute(
+            "SELECT user_id, action, last_used, duration, kind FROM user_timers WHERE end_time > ?",
+            (now,)
         )
-    ''')
-    conn.commit()
-
-def load_data_from_db():
-    cursor.execute("SELECT user_id, action, last_used FROM user_timers")
-    for row in cursor.fetchall():
-        user_id, action, timestamp = row
-        if user_id not in last_used:
-            last_used[user_id] = {}
-        last_used[user_id][action] = timestamp
-
-def save_timer_to_db(user_id, action_name):
-    cursor.execute('''
-        INSERT OR REPLACE INTO user_timers (user_id, action, last_used)
-        VALUES (?, ?, ?)
-    ''', (user_id, action_name, time.time()))
-    conn.commit()
-    log_event("Использование действия", user_id, action_name, "Записано в БД")
+        while True:
+            chunk = rows.fetchmany(TIMER_LOAD_CHUNK)
+            if not chunk:
+                break
+            for user_id, *row in chunk:
+                if user_id not in preloaded_users:
+                    start_timer_from_row(user_id, *row)
+            await asyncio.sleep(0)
 
-# --- Хранилище времени использования ---
-last_used = {}  # user_id -> {action -> last_used_time}
-pending_notifications = []  # {user_id, action_name, end_time, message}
+    timers_loaded = True
+    preloaded_users.clear()
 
-# --- Логирование ---
-def log_event(event_type: str, user_id: int, action_name: str = None, message: str = None):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    cursor.execute('''
-        INSERT INTO logs (timestamp, event_type, user_id, action_name, message)
+def ensure_user_loaded(user_id):
+    if MULTI_PROCESS:
+        refresh_user_timers(user_id)
+        return
+
+    # Игрок пришёл раньше, чем фоновая загрузка дошла до его строк
+    if timers_loaded or user_id in preloaded_users:
+        return
+
+    now = time.time()
+    with read_pool.connection() as db:
+        rows = db.execute(
+            "SELECT action, last_used, duration, kind FROM user_timers WHERE user_id = ? AND end_time > ?",
+            (user_id, now)
+        ).fetchall()
+
+    for row in rows:
+        start_timer_from_row(user_id, *row)
+    preloaded_users.add(user_id)
+
+# --- Общие таймеры нескольких процессов ---
+SHARED_WRITE_GRACE = 5.0  # сколько секунд своя запись главнее строки в БД
+
+local_writes = collections.OrderedDict()  # (user_id, action) -> time.monotonic() записи
+
+
+def mark_local_write(user_id, action_name):
+    if MULTI_PROCESS:
+        local_writes[(user_id, action_name)] = time.monotonic()
+        local_writes.move_to_end((user_id, action_name))
+
+def get_users_timers_from_db(user_ids, now):
+    # Живые таймеры сразу нескольких игроков: user_id -> [строка для refresh_user_timers]
+    timers = {user_id: [] for user_id in user_ids}
+    user_ids = list(timers)
+    with read_pool.connection() as db:
+        for i in range(0, len(user_ids), DB_IN_CHUNK):
+            chunk = user_ids[i:i + DB_IN_CHUNK]
+            rows = db.execute(f'''
+                SELECT user_id, action, last_used, duration, kind FROM user_timers
+                WHERE user_id IN ({", ".join("?" * len(chunk))}) AND end_time > ?
+            ''', (*chunk, now))
+            for user_id, *row in rows:
+                timers[user_id].append(row)
+    return timers
+
+def refresh_user_timers(user_id, rows=None):
+    # Источник правды — БД, TimerStore только кэш: игрок мог нажать кнопку на
+    # сервере другого процесса. Свои недавние записи ещё могут стоять в очереди
+    # DBWriter, поэтому их не перетираем старыми строками.
+    # rows — уже прочитанные строки get_users_timers_from_db
+    now = time.time()
+    horizon = time.monotonic() - SHARED_WRITE_GRACE
+    while local_writes and next(iter(local_writes.values())) < horizon:
+        local_writes.popitem(last=False)
+
+    if rows is None:
+        rows = get_users_timers_from_db([user_id], now)[user_id]
+
+    stored = set()
+    for action, timestamp, duration, kind in rows:
+        stored.add(action)
+        if (user_id, action) in local_writes:
+            continue
+        record = timer_store.get(user_id, action)
+        if record is None or record.started_at != timestamp or record.end_time != timestamp + duration:
+            start_timer_from_row(user_id, action, timestamp, duration, kind)
+
+    for action_name, _ in timer_store.active_timers(user_id, now):
+        if action_name not in stored and (user_id, action_name) not in local_writes:
+            timer_store.remove(user_id, action_name)
+
+def command_tree_hash():
+    payload = []
+    for command in tree.get_commands():
+        try:
+            payload.append(command.to_dict(tree))
+        except TypeError:  # discord.py < 2.4
+            payload.append(command.to_dict())
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+def get_state_from_db(key):
+    with read_pool.connection() as db:
+        row = db.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def save_state_to_db(key, value):
+    db_writer.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, value))
+
+def save_timer_to_db(record, guild_id=None):
+    db_writer.execute('''
+        INSERT OR REPLACE INTO user_timers (user_id, action, last_used, duration, end_time, kind)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (
+        record.user_id, record.action_name, record.started_at,
+        record.end_time - record.started_at, record.end_time, int(record.kind)
+    ))
+    mark_local_write(record.user_id, record.action_name)
+    log_event(EventType.ACTION_USED, record.user_id, record.action_name, "Записано в БД", guild_id)
+
+def save_timers_to_db(records):
+    # Пачка таймеров — одна операция DBWriter, а значит одна транзакция.
+    # records: ((TimerRecord, сервер, где запущен), ...)
+    db_writer.executemany('''
+        INSERT OR REPLACE INTO user_timers (user_id, action, last_used, duration, end_time, kind)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(
+        record.user_id, record.action_name, record.started_at,
+        record.end_time - record.started_at, record.end_time, int(record.kind)
+    ) for record, _ in records])
+    for record, guild_id in records:
+        mark_local_write(record.user_id, record.action_name)
+        log_event(EventType.ACTION_USED, record.user_id, record.action_name, "Записано в БД", guild_id)
+
+def save_timer_mode_to_db(guild_id, timer_mode):
+    db_writer.execute('''
+        INSERT OR REPLACE INTO guild_settings (guild_id, timer_mode)
+        VALUES (?, ?)
+    ''', (guild_id, timer_mode))
+
+def delete_timer_from_db(user_id, action_name):
+    db_writer.execute("DELETE FROM user_timers WHERE user_id=? AND action=?", (user_id, action_name))
+    mark_local_write(user_id, action_name)
+
+def delete_timers_from_db(user_id, action_names):
+    db_writer.executemany(
+        "DELETE FROM user_timers WHERE user_id=? AND action=?",
+        [(user_id, action_name) for action_name in action_names]
+    )
+    for action_name in action_names:
+        mark_local_write(user_id, action_name)
+
+def get_preset_from_db(user_id):
+    with read_pool.connection() as db:
+        row = db.execute("SELECT actions FROM user_presets WHERE user_id = ?", (user_id,)).fetchone()
+    return json.loads(row[0]) if row else []
+
+def save_preset_to_db(user_id, action_names):
+    db_writer.execute(
+        "INSERT OR REPLACE INTO user_presets (user_id, actions) VALUES (?, ?)",
+        (user_id, json.dumps(action_names, ensure_ascii=False))
+    )
+
+Routine = collections.namedtuple("Routine", "action_name repeat next_action guild_id")
+
+
+def get_routine_from_db(user_id, action_name):
+    with read_pool.connection() as db:
+        row = db.execute(
+            "SELECT action_name, repeat, next_action, guild_id FROM timer_routines WHERE user_id = ? AND action_name = ?",
+            (user_id, action_name)
+        ).fetchone()
+    return Routine(*row) if row else None
+
+def get_routines_from_db(user_id):
+    with read_pool.connection() as db:
+        rows = db.execute(
+            "SELECT action_name, repeat, next_action, guild_id FROM timer_routines WHERE user_id = ? ORDER BY action_name",
+            (user_id,)
+        ).fetchall()
+    return [Routine(*row) for row in rows]
+
+def get_due_routines_from_db(keys):
+    # (user_id, action_name) -> Routine одним запросом на пачку сработавших уведомлений
+    routines = {}
+    with read_pool.connection() as db:
+        for i in range(0, len(keys), DB_IN_CHUNK):
+            chunk = keys[i:i + DB_IN_CHUNK]
+            rows = db.execute(f'''
+                SELECT user_id, action_name, repeat, next_action, guild_id FROM timer_routines
+                WHERE (user_id, action_name) IN (VALUES {", ".join(["(?, ?)"] * len(chunk))})
+            ''', [value for key in chunk for value in key])
+            for user_id, *row in rows:
+                routines[(user_id, row[0])] = Routine(*row)
+    return routines
+
+def save_routine_to_db(user_id, routine):
+    if not routine.repeat and not routine.next_action:
+        delete_routine_from_db(user_id, routine.action_name)
+        return
+    db_writer.execute('''
+        INSERT OR REPLACE INTO timer_routines (user_id, action_name, repeat, next_action, guild_id)
         VALUES (?, ?, ?, ?, ?)
-    ''', (timestamp, event_type, user_id, action_name, message))
-    conn.commit()
-    print(f"[{event_type}] Пользователь {user_id}, действие: {action_name or 'N/A'} → {message or ''}")
+    ''', (user_id, routine.action_name, int(routine.repeat), routine.next_action, routine.guild_id))
+
+def delete_routine_from_db(user_id, action_name):
+    db_writer.execute("DELETE FROM timer_routines WHERE user_id = ? AND action_name = ?", (user_id, action_name))
+
+def get_delivery_from_db(user_id):
+    with read_pool.connection() as db:
+        row = db.execute(
+            "SELECT mode, digest_minutes, quiet_start, quiet_end, utc_offset FROM delivery_settings WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+    return DeliveryPrefs(*row) if row else DELIVERY_DEFAULT
+
+def get_deliveries_from_db(user_ids):
+    # user_id -> DeliveryPrefs; игроки без настроек получают DELIVERY_DEFAULT
+    prefs = dict.fromkeys(user_ids, DELIVERY_DEFAULT)
+    user_ids = list(prefs)
+    with read_pool.connection() as db:
+        for i in range(0, len(user_ids), DB_IN_CHUNK):
+            chunk = user_ids[i:i + DB_IN_CHUNK]
+            rows = db.execute(f'''
+                SELECT user_id, mode, digest_minutes, quiet_start, quiet_end, utc_offset FROM delivery_settings
+                WHERE user_id IN ({", ".join("?" * len(chunk))})
+            ''', chunk)
+            for user_id, *row in rows:
+                prefs[user_id] = DeliveryPrefs(*row)
+    return prefs
+
+def save_delivery_to_db(user_id, prefs):
+    db_writer.execute('''
+        INSERT OR REPLACE INTO delivery_settings (user_id, mode, digest_minutes, quiet_start, quiet_end, utc_offset)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, *prefs))
+
+def save_notifications_to_db(rows):
+    db_writer.executemany('''
+        INSERT OR REPLACE INTO notifications (user_id, action_name, end_time, guild_id)
+        VALUES (?, ?, ?, ?)
+    ''', rows)
+    for user_id, action_name, *_ in rows:
+        timer_store.mark_changed(user_id, action_name)
+
+def save_notification_to_db(user_id, action_name, end_time, guild_id=None):
+    db_writer.execute('''
+        INSERT OR REPLACE INTO notifications (user_id, action_name, end_time, guild_id)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, action_name, end_time, guild_id))
+    timer_store.mark_changed(user_id, action_name)
+
+def delete_notifications_from_db(keys):
+    db_writer.executemany("DELETE FROM notifications WHERE user_id=? AND action_name=?", keys)
+    for user_id, action_name in keys:
+        timer_store.mark_changed(user_id, action_name)
+
+def delete_fired_notifications_from_db(notifies):
+    # Сверяем end_time, чтобы не стереть таймер, перезапущенный пока шла отправка
+    db_writer.executemany(
+        "DELETE FROM notifications WHERE user_id=? AND action_name=? AND end_time=?",
+        [(n["user_id"], n["action_name"], n["end_time"]) for n in notifies]
+    )
+    for n in notifies:
+        timer_store.mark_changed(n["user_id"], n["action_name"])
+
+def new_notify(user_id, action_name, end_time, guild_id=None):
+    return {"user_id": user_id, "action_name": action_name, "end_time": end_time, "guild_id": guild_id, "message": None}
+
+def iter_notifications_from_db(after, until):
+    # Отдаём строки по одной, а не fetchall — в таблице могут быть сотни тысяч записей
+    with read_pool.connection() as db:
+        yield from db.execute('''
+            SELECT user_id, action_name, end_time, guild_id FROM notifications
+            WHERE end_time > ? AND end_time <= ?
+            ORDER BY end_time
+        ''', (after, until))
+
+# --- Аренда уведомлений ---
+NOTIFY_LEASE = 300  # секунд, за которые владелец должен отправить уведомление
+NOTIFY_ORPHAN_GRACE = 60  # через сколько после срока чужое уведомление считается брошенным
+NOTIFY_ORPHAN_SWEEP = 30  # как часто ищем брошенные уведомления
+NOTIFY_ORPHAN_BATCH = 500
+
+lease_db = None
+lease_lock = threading.Lock()
+
+
+def lease_connection():
+    # Захват аренды должен видеть ответ сразу, поэтому мимо очереди DBWriter
+    global lease_db
+    if lease_db is None:
+        lease_db = connect_db()
+    return lease_db
+
+def claim_notifications_in_db(notifies, now):
+    # Уведомление отправляет только процесс, чей UPDATE сработал. end_time
+    # сверяем, чтобы не захватить таймер, перезапущенный после загрузки окна
+    claimed = []
+    started = time.perf_counter()
+    with lease_lock:
+        db = lease_connection()
+        with db:
+            for notify in notifies:
+                cursor = db.execute('''
+                    UPDATE notifications SET owner = ?, lease_until = ?
+                    WHERE user_id = ? AND action_name = ? AND end_time = ?
+                    AND (lease_until IS NULL OR lease_until < ?)
+                ''', (WORKER_ID, now + NOTIFY_LEASE, notify["user_id"], notify["action_name"], notify["end_time"], now))
+                if cursor.rowcount:
+                    claimed.append(notify)
+    if metrics.enabled:
+        metrics.observe("farm_bot_db_seconds", time.perf_counter() - started, op="lease")
+    return claimed
+
+def extend_notification_leases_in_db(notifies, until):
+    # Отложенная доставка (тихие часы, дайджест) держит аренду до отправки,
+    # иначе уборщик брошенных уведомлений отдаст их другому процессу
+    db_writer.executemany(
+        "UPDATE notifications SET lease_until = ? WHERE user_id = ? AND action_name = ? AND end_time = ? AND owner = ?",
+        [(until, n["user_id"], n["action_name"], n["end_time"], WORKER_ID) for n in notifies]
+    )
 
-# --- Меню фарма ---
-class FarmMenu(ui.View):
+def claim_orphaned_notifications_in_db(now):
+    # Просроченные уведомления, которые никто не взял: процесс-владелец упал
+    # или строка появилась уже после того, как остальные загрузили своё окно
+    with lease_lock:
+        db = lease_connection()
+        with db:
+            rows = db.execute('''
+                UPDATE notifications SET owner = ?, lease_until = ?
+                WHERE rowid IN (
+                    SELECT rowid FROM notifications
+                    WHERE end_time <= ? AND (lease_until IS NULL OR lease_until < ?)
+                    ORDER BY end_time
+                    LIMIT ?
+                )
+                RETURNING user_id, action_name, end_time, guild_id
+            ''', (WORKER_ID, now + NOTIFY_LEASE, now - NOTIFY_ORPHAN_GRACE, now, NOTIFY_ORPHAN_BATCH)).fetchall()
+    return [new_notify(*row) for row in rows]
+
+# --- Хранилище времени использования ---
+TimerRecord = collections.namedtuple("TimerRecord", "user_id action_name started_at end_time kind")
+
+TIMER_EXPIRY_BUCKET = 60  # ширина корзины индекса по времени окончания, секунды
+
+
+class TimerStore:
+    # Таймеры лежат в параллельных массивах, запись = номер слота. Названия
+    # действий интернируются в маленькие int. Два индекса хранят только номера
+    # слотов: список слотов игрока и корзины по времени окончания (куча номеров
+    # корзин для pop_expired). Освобождённые и перезапущенные слоты из корзин
+    # убираются лениво. Журнал изменений для дельта-снимков ведётся по запросу.
+    def __init__(self, action_names=()):
+        self._action_ids = {}  # название -> id
+        self._action_names = []  # id -> название
+        self._user_ids = array.array("q")
+        self._actions = array.array("i")  # -1 — слот свободен
+        self._started = array.array("d")
+        self._ends = array.array("d")
+        self._kinds = array.array("b")
+        self._free = []
+        self._by_user = {}  # user_id -> [slot]
+        self._expiry = {}  # номер корзины -> [slot]
+        self._expiry_keys = []  # куча номеров корзин
+        self._journal = None  # (user_id, action_id), изменённые после полного снимка; None — не ведётся
+        self._count = 0
+        for action_name in action_names:
+            self.action_id(action_name)
+
+    def __len__(self):
+        return self._count
+
+    def action_id(self, action_name):
+        action_id = self._action_ids.get(action_name)
+        if action_id is None:
+            action_id = self._action_ids[action_name] = len(self._action_names)
+            self._action_names.append(action_name)
+        return action_id
+
+    def action_name(self, action_id):
+        return self._action_names[action_id]
+
+    def _record(self, slot):
+        return TimerRecord(
+            self._user_ids[slot], self._action_names[self._actions[slot]],
+            self._started[slot], self._ends[slot], TimerKind(self._kinds[slot])
+        )
+
+    def _find(self, user_id, action_id):
+        for slot in self._by_user.get(user_id, ()):
+            if self._actions[slot] == action_id:
+                return slot
+        return None
+
+    def start(self, user_id, action_name, started_at, duration=None, kind=TimerKind.CATALOG):
+        # Дедлайн считается один раз здесь; дальше проверки — одно сравнение с ним
+        action_id = self.action_id(action_name)
+        if duration is None:
+            duration = get_cooldown(action_name)
+        end_time = started_at + duration
+
+        slot = self._find(user_id, action_id)
+        if slot is None:
+            slot = self._allocate(user_id, action_id)
+        if self._journal is not None:
+            self._journal.add((user_id, action_id))
+        self._started[slot] = started_at
+        self._ends[slot] = end_time
+        self._kinds[slot] = kind
+
+        bucket_key = int(end_time // TIMER_EXPIRY_BUCKET)
+        bucket = self._expiry.get(bucket_key)
+        if bucket is None:
+            bucket = self._expiry[bucket_key] = []
+            heapq.heappush(self._expiry_keys, bucket_key)
+        bucket.append(slot)
+        return self._record(slot)
+
+    def _allocate(self, user_id, action_id):
+        if self._free:
+            slot = self._free.pop()
+            self._user_ids[slot] = user_id
+            self._actions[slot] = action_id
+        else:
+            slot = len(self._actions)
+            self._user_ids.append(user_id)
+            self._actions.append(action_id)
+            self._started.append(0.0)
+            self._ends.append(0.0)
+            self._kinds.append(0)
+
+        self._by_user.setdefault(user_id, []).append(slot)
+        self._count += 1
+        return slot
+
+    def _release(self, slot):
+        user_id = self._user_ids[slot]
+
+        slots = self._by_user[user_id]
+        slots.remove(slot)
+        if not slots:
+            del self._by_user[user_id]
+
+        self._actions[slot] = -1
+        self._free.append(slot)
+        self._count -= 1
+
+    def get(self, user_id, action_name):
+        action_id = self._action_ids.get(action_name)
+        slot = None if action_id is None else self._find(user_id, action_id)
+        return None if slot is None else self._record(slot)
+
+    def remove(self, user_id, action_name):
+        action_id = self._action_ids.get(action_name)
+        slot = None if action_id is None else self._find(user_id, action_id)
+        if slot is None:
+            return False
+        if self._journal is not None:
+            self._journal.add((user_id, action_id))
+        self._release(slot)
+        return True
+
+    # Журнал изменений для дельта-снимков. Истёкшие таймеры в него не попадают:
+    # в снимке-основе у них end_time в прошлом, и после восстановления они
+    # так же недействительны
+    def start_journal(self):
+        self._journal = set()
+
+    def journal(self):
+        if self._journal is None:
+            return None
+        return [(user_id, self._action_names[action_id]) for user_id, action_id in self._journal]
+
+    def mark_changed(self, user_id, action_name):
+        # Уведомления живут в той же паре (игрок, действие) и отмечаются здесь же
+        if self._journal is not None:
+            self._journal.add((user_id, self.action_id(action_name)))
+
+    def has_timers(self, user_id):
+        return user_id in self._by_user
+
+    def active_timers(self, user_id, now):
+        return [
+            (self._action_names[self._actions[slot]], self._ends[slot])
+            for slot in self._by_user.get(user_id, ())
+            if self._ends[slot] > now
+        ]
+
+    def pop_expired(self, before, limit=None):
+        expired = []
+        while self._expiry_keys and (limit is None or len(expired) < limit):
+            bucket_key = self._expiry_keys[0]
+            if bucket_key * TIMER_EXPIRY_BUCKET > before:
+                break
+
+            keep = []
+            for slot in self._expiry[bucket_key]:
+                # Слот освобождён или таймер перезапущен и переехал в другую корзину
+                if self._actions[slot] == -1 or int(self._ends[slot] // TIMER_EXPIRY_BUCKET) != bucket_key:
+                    continue
+                if self._ends[slot] <= before and (limit is None or len(expired) < limit):
+                    expired.append(self._record(slot))
+                    self._release(slot)
+                else:
+                    keep.append(slot)
+
+            if keep:
+                # Корзина пересекает before или упёрлись в limit — доберём позже
+                self._expiry[bucket_key] = keep
+                break
+            del self._expiry[bucket_key]
+            heapq.heappop(self._expiry_keys)
+        return expired
+
+    def load_columns(self, user_ids, actions, started, ends, kinds, action_names):
+        # Массовая загрузка снимка в пустое хранилище: колонки копируются
+        # целиком, индексы строятся одним проходом без start() на каждую строку
+        if self._count:
+            raise ValueError("хранилище таймеров не пустое")
+        ids = [self.action_id(action_name) for action_name in action_names]
+        if ids == list(range(len(ids))):
+            self._actions = array.array("i", actions)
+        else:
+            self._actions = array.array("i", (ids[action] for action in actions))
+        self._user_ids = array.array("q", user_ids)
+        self._started = array.array("d", started)
+        self._ends = array.array("d", ends)
+        self._kinds = array.array("b", kinds)
+        self._free = []
+
+        by_user = self._by_user = {}
+        expiry = self._expiry = {}
+        for slot, (user_id, end_time) in enumerate(zip(self._user_ids, self._ends)):
+            by_user.setdefault(user_id, []).append(slot)
+            expiry.setdefault(int(end_time // TIMER_EXPIRY_BUCKET), []).append(slot)
+
+        self._expiry_keys = list(expiry)
+        heapq.heapify(self._expiry_keys)
+        self._count = len(self._actions)
+
+
+timer_store = TimerStore(get_catalog().actions)
+
+
+# --- Режим отображения таймеров ---
+TIMER_MODE_LIVE = "live"  # бот сам перерисовывает отсчёт
+TIMER_MODE_RELATIVE = "relative"  # отсчёт рисует клиент Discord по разметке <t:unix:R>
+TIMER_MODE_DEFAULT = TIMER_MODE_LIVE
+
+guild_timer_modes = {}  # guild_id -> режим
+
+
+def get_timer_mode(guild_id):
+    return guild_timer_modes.get(guild_id, TIMER_MODE_DEFAULT)
+
+def timer_field_value(end_time, mode):
+    if mode == TIMER_MODE_RELATIVE:
+        return f"Доступно <t:{int(end_time)}:R>"
+
+    remaining = max(0, int(end_time - time.time()))
+    hours, remainder = divmod(remaining, 3600)
+    mins, secs = divmod(remainder, 60)
+    # Секунды только на последней минуте: дальше список и так правится не чаще
+    # раза в минуту, а строка без секунд не меняется между правками
+    if remaining > 60:
+        return f"Доступно через: `{hours} ч {mins} мин`"
+    return f"Доступно через: `{hours} ч {mins} мин {secs} сек`"
+
+
+# --- Планировщик уведомлений ---
+NOTIFY_WINDOW = 3600  # сколько секунд вперёд держим уведомления в памяти
+NOTIFY_BURST = 500  # сколько просроченных уведомлений передаём в доставку за раз;
+# темп отправки держат лимиты DMPipeline, а крупная пачка склеивает ЛС одного игрока
+NOTIFY_BURST_DELAY = 0.1  # пауза между пачками при догоняющей отправке
+
+
+class NotificationScheduler:
+    # Min-heap по end_time. Отмена ленивая: запись помечается пустой и
+    # выбрасывается, когда доходит до вершины кучи.
+    # Все уведомления лежат в таблице notifications, а в куче — только
+    # ближайшее окно NOTIFY_WINDOW; остальное подгружается по мере сдвига окна.
     def __init__(self):
-        super().__init__(timeout=None)
+        self._heap = []  # [end_time, seq, notify]
+        self._entries = {}  # (user_id, action_name) -> запись в куче
+        self._counter = itertools.count()
+        self._cancelled = 0
+        self._window_end = 0  # всё, что раньше, уже загружено из БД
+        self._sliding = None  # ключи, отменённые пока окно подгружается из БД
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, user_id, action_name, end_time, guild_id=None):
+        # guild_id — сервер, из каталога которого берётся текст уведомления
+        self.cancel(user_id, action_name, persist=False)
+        save_notification_to_db(user_id, action_name, end_time, guild_id)
+
+        notify = new_notify(user_id, action_name, end_time, guild_id)
+        if end_time <= self._window_end:
+            self._push(notify)
+        return notify
+
+    def add_many(self, rows):
+        # rows: [(user_id, action_name, end_time, guild_id)] — одна запись в БД на всю пачку
+        for user_id, action_name, *_ in rows:
+            self.cancel(user_id, action_name, persist=False)
+        save_notifications_to_db(rows)
+
+        for row in rows:
+            if row[2] <= self._window_end:
+                self._push(new_notify(*row))
+
+    def _push(self, notify):
+        key = (notify["user_id"], notify["action_name"])
+        if key in self._entries:
+            return
 
-    async def handle_button_click(self, interaction: discord.Interaction, action_name: str):
-        user_id = interaction.user.id
+        entry = [notify["end_time"], next(self._counter), notify]
+        self._entries[key] = entry
 
-        if not is_action_available(user_id, action_name):
-            await self.show_countdown(interaction, action_name)
+        wake = not self._heap or entry[0] < self._heap[0][0]
+        heapq.heappush(self._heap, entry)
+        if wake:
+            self._wakeup.set()
+
+    async def _advance_window(self, now):
+        if now + NOTIFY_WINDOW / 2 < self._window_end:
             return
 
-        last_used.setdefault(user_id, {})[action_name] = time.time()
-        save_timer_to_db(user_id, action_name)
+        # Строки пишет DBWriter пачками. Сначала сдвигаем границу, чтобы новые
+        # add() сразу шли в кучу, затем ждём коммита того, что уже в очереди.
+        # Отмены, пришедшие во время ожидания, могли ещё не дойти до БД —
+        # их строки при чтении пропускаем
+        after, self._window_end = self._window_end, now + NOTIFY_WINDOW
+        self._sliding = set()
+        await asyncio.to_thread(db_writer.flush)
+        skip, self._sliding = self._sliding, None
+        for row in iter_notifications_from_db(after, self._window_end):
+            if (row[0], row[1]) not in skip:
+                self._push(new_notify(*row))
+
+    def cancel(self, user_id, action_name, persist=True):
+        if persist:
+            delete_notifications_from_db([(user_id, action_name)])
+        if self._sliding is not None:
+            self._sliding.add((user_id, action_name))
+
+        entry = self._entries.pop((user_id, action_name), None)
+        if entry is None:
+            return False
 
-        pending_notifications.append({
-            "user_id": user_id,
-            "action_name": action_name,
-            "end_time": time.time() + get_cooldown(action_name),
-            "message": None
-        })
+        entry[2] = None
+        self._cancelled += 1
+        if self._cancelled > 1024 and self._cancelled * 2 > len(self._heap):
+            self._compact()
+        return True
+
+    def cancel_many(self, keys):
+        delete_notifications_from_db(keys)
+        for user_id, action_name in keys:
+            self.cancel(user_id, action_name, persist=False)
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[2] is not None]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+            self._cancelled -= 1
+
+    def next_deadline(self):
+        self._drop_cancelled()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, limit=None):
+        due = []
+        while limit is None or len(due) < limit:
+            self._drop_cancelled()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, notify = heapq.heappop(self._heap)
+            del self._entries[(notify["user_id"], notify["action_name"])]
+            due.append(notify)
+        return due
+
+    async def wait(self):
+        # Спим ровно до ближайшего дедлайна или до вставки более раннего таймера
+        self._wakeup.clear()
+        await self._advance_window(time.time())
+        deadline = self.next_deadline()
+        if deadline is None or deadline > self._window_end - NOTIFY_WINDOW / 2:
+            deadline = self._window_end - NOTIFY_WINDOW / 2
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            return
 
-        await interaction.response.send_message(f"✅ Вы начали: **{action_name}**", ephemeral=True)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
 
-    async def show_countdown(self, interaction: discord.Interaction, action_name: str):
-        user_id = interaction.user.id
-        cooldown = get_cooldown(action_name)
-        end_time = last_used.get(user_id, {}).get(action_name, 0) + cooldown
-        remaining = max(0, int(end_time - time.time()))
 
-        embed = discord.Embed(
-            title=f"⏳ Ожидание: {action_name}",
-            color=discord.Color.orange()
+notification_scheduler = NotificationScheduler()
+
+# --- Очистка истёкших таймеров ---
+COMPACT_INTERVAL = 600  # как часто запускается компактор, секунды
+COMPACT_BATCH = 500  # строк за один DELETE
+COMPACT_GRACE = 86400  # сколько держим истёкший таймер перед удалением
+COMPACT_VACUUM_HOURS = range(4, 6)  # локальные часы с минимальным трафиком
+COMPACT_VACUUM_PAGES = 2000  # страниц за один incremental_vacuum
+
+
+class TimerCompactor:
+    def __init__(self):
+        self.rows_deleted = 0
+        self.timers_evicted = 0
+        self.bytes_reclaimed = 0
+        self._full_vacuum_day = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(COMPACT_INTERVAL)
+            try:
+                await self.compact()
+            except Exception as e:
+                print(f"[Ошибка] Сбой компактора: {e}")
+
+    async def compact(self):
+        cutoff = time.time() - COMPACT_GRACE
+
+        evicted = 0
+        while True:
+            records = timer_store.pop_expired(cutoff, limit=COMPACT_BATCH)
+            evicted += len(records)
+            if len(records) < COMPACT_BATCH:
+                break
+            await asyncio.sleep(0)
+
+        deleted = 0
+        while True:
+            rowids = self._expired_rowids(cutoff)
+            if rowids:
+                db_writer.executemany(
+                    "DELETE FROM user_timers WHERE rowid = ? AND end_time < ?",
+                    [(rowid, cutoff) for rowid in rowids]
+                )
+                await asyncio.get_running_loop().run_in_executor(None, db_writer.flush)
+                deleted += len(rowids)
+            if len(rowids) < COMPACT_BATCH:
+                break
+
+        reclaimed = await self._vacuum_if_quiet()
+
+        self.timers_evicted += evicted
+        self.rows_deleted += deleted
+        self.bytes_reclaimed += reclaimed
+        if evicted or deleted or reclaimed:
+            log_event(
+                EventType.TIMERS_COMPACTED, None, None,
+                f"Из памяти: {evicted}, строк удалено: {deleted}, освобождено байт: {reclaimed}"
+            )
+
+    def _expired_rowids(self, cutoff):
+        with read_pool.connection() as db:
+            rows = db.execute(
+                "SELECT rowid FROM user_timers WHERE end_time < ? LIMIT ?",
+                (cutoff, COMPACT_BATCH)
+            ).fetchall()
+        return [rowid for rowid, in rows]
+
+    def _db_size(self):
+        with read_pool.connection() as db:
+            page_count = db.execute("PRAGMA page_count").fetchone()[0]
+            page_size = db.execute("PRAGMA page_size").fetchone()[0]
+            auto_vacuum = db.execute("PRAGMA auto_vacuum").fetchone()[0]
+        return page_count * page_size, auto_vacuum
+
+    async def _vacuum_if_quiet(self):
+        now = time.localtime()
+        if now.tm_hour not in COMPACT_VACUUM_HOURS:
+            return 0
+
+        size_before, auto_vacuum = self._db_size()
+        if auto_vacuum == 2:  # INCREMENTAL
+            db_writer.maintenance(f"PRAGMA incremental_vacuum({COMPACT_VACUUM_PAGES})")
+        elif self._full_vacuum_day != now.tm_yday:
+            # Полный VACUUM не чаще раза в сутки; заодно включает incremental на будущее
+            self._full_vacuum_day = now.tm_yday
+            db_writer.maintenance("PRAGMA auto_vacuum=INCREMENTAL")
+            db_writer.maintenance("VACUUM")
+        else:
+            return 0
+
+        db_writer.maintenance("PRAGMA wal_checkpoint(TRUNCATE)")
+        await asyncio.get_running_loop().run_in_executor(None, db_writer.flush)
+        size_after, _ = self._db_size()
+        return max(0, size_before - size_after)
+
+
+timer_compactor = TimerCompactor()
+
+
+# --- Снимки состояния ---
+# Полный снимок — два файла: копия базы через backup API и компактный .snap —
+# таймеры и уведомления колонками array, названия действий словарём,
+# настройки JSON-ом в заголовке, в конце sha256 всего файла.
+# Дельта (.delta) — тот же формат, но только пары (игрок, действие) из журнала
+# TimerStore, изменённые после полного снимка: новые строки колонками как в
+# .snap, удалённые — колонками deleted_*. Дельты накопительные: для
+# восстановления нужны основа и последняя дельта, а не вся цепочка.
+# BOT_RESTORE_SNAPSHOT=путь.snap|.delta при запуске поднимает состояние из
+# снимка вместо построчной загрузки user_timers.
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_KEEP = 10  # сколько последних полных снимков хранить; дельты живут, пока жива их основа
+SNAPSHOT_MAGIC = b"FARMSNP1"
+SNAPSHOT_VERSION = 3  # 2 — у уведомлений есть сервер, 3 — дельты; версия 1 читается с каталогом по умолчанию
+SNAPSHOT_COLUMNS = (
+    ("user_id", "q"), ("action", "i"), ("started_at", "d"), ("end_time", "d"), ("kind", "b"),
+    ("notify_user_id", "q"), ("notify_action", "i"), ("notify_end_time", "d"), ("notify_guild_id", "q"),
+)
+SNAPSHOT_DELTA_COLUMNS = SNAPSHOT_COLUMNS + (
+    ("deleted_user_id", "q"), ("deleted_action", "i"),
+    ("notify_deleted_user_id", "q"), ("notify_deleted_action", "i"),
+)
+SNAPSHOT_CONFIG_TABLES = ("guild_settings", "timer_routines", "delivery_settings", "user_presets")
+SNAPSHOT_RESTORE = os.getenv("BOT_RESTORE_SNAPSHOT")
+
+Snapshot = collections.namedtuple("Snapshot", "created_at actions columns config digest base")
+
+snapshot_base = None  # (путь, sha256) последнего полного снимка этого процесса — основа дельт
+
+
+def backup_db(path):
+    # Одним шагом backup API: в WAL это чтение согласованного среза, писатель
+    # не ждёт. Пошаговая копия перезапускалась бы после каждого коммита DBWriter
+    tmp = path + ".tmp"
+    source = connect_db()
+    target = sqlite3.connect(tmp)
+    try:
+        source.backup(target)
+        (result,) = target.execute("PRAGMA integrity_check").fetchone()
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"копия базы повреждена: {result}")
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp, path)
+
+def write_snapshot(path, changed=None, base=None):
+    # changed — пары (игрок, действие) для дельты, base — {"file", "digest"} её основы.
+    # Возвращает (таймеров, уведомлений, sha256 файла)
+    now = time.time()
+    names = {}
+    layout = SNAPSHOT_COLUMNS if changed is None else SNAPSHOT_DELTA_COLUMNS
+    columns = {name: array.array(typecode) for name, typecode in layout}
+    config = {}
+
+    def add_timer(user_id, action, started_at, end_time, kind):
+        columns["user_id"].append(user_id)
+        columns["action"].append(names.setdefault(action, len(names)))
+        columns["started_at"].append(started_at)
+        columns["end_time"].append(end_time)
+        columns["kind"].append(kind or 0)
+
+    def add_notification(user_id, action_name, end_time, guild_id):
+        columns["notify_user_id"].append(user_id)
+        columns["notify_action"].append(names.setdefault(action_name, len(names)))
+        columns["notify_end_time"].append(end_time)
+        columns["notify_guild_id"].append(guild_id or 0)
+
+    with read_pool.connection() as db:
+        db.execute("BEGIN")  # все выборки из одного среза базы
+        if changed is None:
+            rows = db.execute(
+                "SELECT user_id, action, last_used, end_time, kind FROM user_timers WHERE end_time > ?", (now,)
+            )
+            for row in rows:
+                add_timer(*row)
+            for row in db.execute("SELECT user_id, action_name, end_time, guild_id FROM notifications"):
+                add_notification(*row)
+        else:
+            # Точечные чтения по первичным ключам обеих таблиц
+            for user_id, action_name in changed:
+                row = db.execute(
+                    "SELECT user_id, action, last_used, end_time, kind FROM user_timers WHERE user_id = ? AND action = ?",
+                    (user_id, action_name)
+                ).fetchone()
+                if row is not None and row[3] > now:
+                    add_timer(*row)
+                else:
+                    columns["deleted_user_id"].append(user_id)
+                    columns["deleted_action"].append(names.setdefault(action_name, len(names)))
+
+                row = db.execute(
+                    "SELECT user_id, action_name, end_time, guild_id FROM notifications WHERE user_id = ? AND action_name = ?",
+                    (user_id, action_name)
+                ).fetchone()
+                if row is not None:
+                    add_notification(*row)
+                else:
+                    columns["notify_deleted_user_id"].append(user_id)
+                    columns["notify_deleted_action"].append(names.setdefault(action_name, len(names)))
+        # Настройки — несколько небольших таблиц, в дельту они идут целиком
+        for table in SNAPSHOT_CONFIG_TABLES:
+            cursor = db.execute(f"SELECT * FROM {table}")
+            config[table] = {"columns": [column[0] for column in cursor.description], "rows": cursor.fetchall()}
+
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "created_at": now,
+        "byteorder": sys.byteorder,
+        "base": base,
+        "actions": list(names),
+        "columns": [[name, typecode, len(columns[name])] for name, typecode in layout],
+        "config": config,
+    }, ensure_ascii=False).encode()
+
+    tmp = path + ".tmp"
+    digest = hashlib.sha256()
+    with open(tmp, "wb") as f:
+        parts = [SNAPSHOT_MAGIC, struct.pack("<I", len(header)), header]
+        parts.extend(columns[name].tobytes() for name, _ in layout)
+        for part in parts:
+            digest.update(part)
+            f.write(part)
+        f.write(digest.digest())
+    os.replace(tmp, path)
+    return len(columns["user_id"]), len(columns["notify_user_id"]), digest.hexdigest()
+
+def read_snapshot(path):
+    # Файл отображается в память: хэш считается прямо по отображению,
+    # колонки копируются в array без промежуточных bytes
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        if len(mm) < len(SNAPSHOT_MAGIC) + 4 + 32 or mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("это не снимок farm-bot")
+        digest = mm[-32:]
+        if hashlib.sha256(view[:-32]).digest() != digest:
+            raise ValueError("контрольная сумма снимка не сходится")
+
+        (header_size,) = struct.unpack_from("<I", mm, len(SNAPSHOT_MAGIC))
+        offset = len(SNAPSHOT_MAGIC) + 4 + header_size
+        header = json.loads(mm[len(SNAPSHOT_MAGIC) + 4:offset])
+        if header["version"] not in (1, 2, SNAPSHOT_VERSION):
+            raise ValueError(f"неизвестная версия снимка: {header['version']}")
+
+        columns = {}
+        for name, typecode, count in header["columns"]:
+            column = array.array(typecode)
+            size = count * column.itemsize
+            column.frombytes(view[offset:offset + size])
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            columns[name] = column
+            offset += size
+        if offset != len(mm) - 32:
+            raise ValueError("размер колонок не сходится с заголовком")
+        if "notify_guild_id" not in columns:
+            columns["notify_guild_id"] = array.array("q", bytes(8 * len(columns["notify_user_id"])))
+
+    return Snapshot(header["created_at"], header["actions"], columns, header["config"], digest.hex(), header.get("base"))
+
+def read_snapshot_with_base(path):
+    # Для дельты — (основа, дельта), для полного снимка — (снимок, None).
+    # Основа ищется рядом с дельтой и должна совпасть по sha256
+    snapshot = read_snapshot(path)
+    if snapshot.base is None:
+        return snapshot, None
+    base = read_snapshot(os.path.join(os.path.dirname(path), snapshot.base["file"]))
+    if base.digest != snapshot.base["digest"]:
+        raise ValueError(f"основа дельты {snapshot.base['file']} не совпадает с записанной")
+    return base, snapshot
+
+def snapshot_rows(snapshot):
+    columns = snapshot.columns
+    actions = snapshot.actions
+    timers = [
+        (user_id, actions[action], started_at, end_time - started_at, end_time, kind)
+        for user_id, action, started_at, end_time, kind in zip(
+            columns["user_id"], columns["action"], columns["started_at"], columns["end_time"], columns["kind"]
+        )
+    ]
+    notifications = [
+        (user_id, actions[action], end_time, guild_id or None)
+        for user_id, action, end_time, guild_id in zip(
+            columns["notify_user_id"], columns["notify_action"], columns["notify_end_time"], columns["notify_guild_id"]
+        )
+    ]
+    return timers, notifications
+
+def snapshot_deleted(snapshot, prefix=""):
+    columns = snapshot.columns
+    return [
+        (user_id, snapshot.actions[action])
+        for user_id, action in zip(columns[prefix + "deleted_user_id"], columns[prefix + "deleted_action"])
+    ]
+
+def restore_snapshot_to_db(snapshot, delta=None):
+    # Всё одной очередью DBWriter: старые строки уходят, строки снимка встают
+    # на их место, поверх них — удаления и строки дельты
+    db_writer.execute("DELETE FROM user_timers")
+    db_writer.execute("DELETE FROM notifications")
+    for source in (snapshot, delta) if delta is not None else (snapshot,):
+        if source is delta:
+            db_writer.executemany("DELETE FROM user_timers WHERE user_id = ? AND action = ?", snapshot_deleted(delta))
+            delete_notifications_from_db(snapshot_deleted(delta, "notify_"))
+        timers, notifications = snapshot_rows(source)
+        db_writer.executemany('''
+            INSERT OR REPLACE INTO user_timers (user_id, action, last_used, duration, end_time, kind)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', timers)
+        save_notifications_to_db(notifications)
+
+    for table, dump in (delta or snapshot).config.items():
+        if table not in SNAPSHOT_CONFIG_TABLES:
+            continue
+        names = ", ".join(dump["columns"])
+        marks = ", ".join("?" * len(dump["columns"]))
+        db_writer.execute(f"DELETE FROM {table}")
+        db_writer.executemany(f"INSERT INTO {table} ({names}) VALUES ({marks})", dump["rows"])
+
+def restore_snapshot_to_memory(snapshot, delta=None):
+    global timer_store, timers_loaded
+    columns = snapshot.columns
+    store = TimerStore(get_catalog().actions)
+    store.load_columns(
+        columns["user_id"], columns["action"], columns["started_at"],
+        columns["end_time"], columns["kind"], snapshot.actions
+    )
+    if delta is not None:
+        # Дельта — тысячи строк против миллиона в основе: обычные remove/start
+        for user_id, action_name in snapshot_deleted(delta):
+            store.remove(user_id, action_name)
+        timers, _ = snapshot_rows(delta)
+        for user_id, action_name, started_at, duration, _, kind in timers:
+            store.start(user_id, action_name, started_at, duration, TimerKind(kind))
+    timer_store = store
+    timers_loaded = True
+    preloaded_users.clear()
+
+    guild_timer_modes.clear()
+    guild_settings = (delta or snapshot).config.get("guild_settings")
+    if guild_settings:
+        for row in guild_settings["rows"]:
+            setting = dict(zip(guild_settings["columns"], row))
+            guild_timer_modes[setting["guild_id"]] = setting["timer_mode"]
+
+def restore_snapshot_on_start(path):
+    # Тот же снимок повторно не накатываем — иначе каждый рестарт с забытой
+    # переменной откатывал бы таймеры к моменту снимка
+    try:
+        snapshot, delta = read_snapshot_with_base(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[Ошибка] Снимок {path} не восстановлен, загружаемся из базы: {e}")
+        return False
+    digest = (delta or snapshot).digest
+    if get_state_from_db("restored_snapshot") == digest:
+        return False
+
+    restore_snapshot_to_db(snapshot, delta)
+    restore_snapshot_to_memory(snapshot, delta)
+    save_state_to_db("restored_snapshot", digest)
+    # Планировщик уведомлений сейчас начнёт читать своё окно из таблицы — ждём коммита
+    db_writer.flush()
+    print(f"[Снимок] Восстановлено таймеров: {len(timer_store)} из {path}")
+    return True
+
+def snapshot_changes():
+    # Вызывается в цикле событий: пары для дельты или None, если пора снимать
+    # полный снимок. Тогда журнал TimerStore начинается заново. С несколькими
+    # процессами журнал видит только свои изменения — всегда полный снимок
+    changed = timer_store.journal()
+    if snapshot_base is None or changed is None or MULTI_PROCESS or len(changed) * 2 > len(timer_store):
+        timer_store.start_journal()
+        return None
+    return changed
+
+def make_snapshot(changed=None):
+    # Блокирующая: из бота вызывается через asyncio.to_thread. С changed пишет
+    # только дельту поверх последнего полного снимка (см. snapshot_changes)
+    global snapshot_base
+    db_writer.flush()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+
+    if changed is not None and snapshot_base is not None:
+        base_path, base_digest = snapshot_base
+        path = f"{os.path.splitext(base_path)[0]}+{stamp}.delta"
+        started = time.perf_counter()
+        timers, notifications, _ = write_snapshot(path, changed, {"file": os.path.basename(base_path), "digest": base_digest})
+        return (
+            f"✅ Дельта `{path}`: {os.path.getsize(path) // 1024} КБ за {time.perf_counter() - started:.2f} с "
+            f"(изменено пар {len(changed)}: таймеров {timers}, уведомлений {notifications})"
         )
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+    # Сбойный полный снимок не должен стать основой следующей дельты
+    snapshot_base = None
+    base = os.path.join(SNAPSHOT_DIR, f"farm_bot-{stamp}")
+    started = time.perf_counter()
+    backup_db(base + ".db")
+    backup_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    timers, notifications, digest = write_snapshot(base + ".snap")
+    snapshot_seconds = time.perf_counter() - started
+    snapshot_base = (base + ".snap", digest)
+
+    for pattern in ("farm_bot-*.db", "farm_bot-*.snap"):
+        for old in sorted(glob.glob(os.path.join(SNAPSHOT_DIR, pattern)))[:-SNAPSHOT_KEEP]:
+            os.remove(old)
+    for old in glob.glob(os.path.join(SNAPSHOT_DIR, "farm_bot-*.delta")):
+        if not os.path.exists(old.split("+")[0] + ".snap"):
+            os.remove(old)
+    return (
+        f"✅ Снимок `{base}`: база {os.path.getsize(base + '.db') // 1024} КБ за {backup_seconds:.2f} с, "
+        f".snap {os.path.getsize(base + '.snap') // 1024} КБ за {snapshot_seconds:.2f} с "
+        f"(таймеров {timers}, уведомлений {notifications})"
+    )
+
 
-        while remaining > 0:
-            hours, remainder = divmod(remaining, 3600)
-            mins, secs = divmod(remainder, 60)
-            timer_text = f"{hours} ч {mins} мин {secs} сек"
+# --- Логирование ---
+LOG_FLUSH_INTERVAL = 1.0  # как часто буфер событий уходит в БД, секунды
+LOG_BUFFER_SIZE = 1000  # при таком размере буфер сбрасывается сразу
+LOG_RETENTION_DAYS = 30  # суточные таблицы событий старше этого удаляются
+LOG_STDOUT_LEVEL = logging.INFO  # события ниже этого уровня в консоль не печатаются
+LOG_STDOUT_SAMPLE = 1.0  # доля событий, которые печатаются в консоль
+
+
+class EventType(enum.IntEnum):
+    ACTION_USED = 1
+    CUSTOM_TIMER = 2
+    TIMER_DELETED = 3
+    CLUB_TASK = 4
+    PROPERTY_PAYMENT = 5
+    TIMER_MODE = 6
+    TIMERS_COMPACTED = 7
+    NOTIFICATION_DISMISSED = 8
+
+
+EVENT_LABELS = {
+    EventType.ACTION_USED: "Использование действия",
+    EventType.CUSTOM_TIMER: "Кастомный таймер",
+    EventType.TIMER_DELETED: "Таймер удалён",
+    EventType.CLUB_TASK: "Использование задания",
+    EventType.PROPERTY_PAYMENT: "Оплата имущества",
+    EventType.TIMER_MODE: "Режим таймеров",
+    EventType.TIMERS_COMPACTED: "Очистка таймеров",
+    EventType.NOTIFICATION_DISMISSED: "Уведомление скрыто",
+}
+
+EVENT_LEVELS = {
+    EventType.ACTION_USED: logging.DEBUG,
+    EventType.NOTIFICATION_DISMISSED: logging.DEBUG,
+}
 
-            bar_length = 20
-            progress = 1 - (remaining / cooldown)
-            filled = int(bar_length * progress)
-            bar = '🟩' * filled + '🟥' * (bar_length - filled)
 
-            embed.description = f"```\n{bar}\n```\nОсталось: **{timer_text}**"
+class EventLog:
+    # События копятся в памяти и пачкой уходят в DBWriter. Храним их в
+    # суточных таблицах events_ГГГГММДД: старые дни удаляются целиком.
+    def __init__(self):
+        self._buffer = []
+        self._partitions = None  # известные суточные таблицы
+        self._retention_checked = None
+        self.dropped_partitions = 0
+
+    def emit(self, event_type, user_id, action_name, message, guild_id=None):
+        self._buffer.append((time.time(), int(event_type), user_id, action_name, message, guild_id))
+        if len(self._buffer) >= LOG_BUFFER_SIZE:
+            self.flush()
+
+        if EVENT_LEVELS.get(event_type, logging.INFO) >= LOG_STDOUT_LEVEL and (
+            LOG_STDOUT_SAMPLE >= 1 or random.random() < LOG_STDOUT_SAMPLE
+        ):
+            print(f"[{EVENT_LABELS[event_type]}] Пользователь {user_id}, действие: {action_name or 'N/A'} → {message or ''}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
             try:
-                await interaction.edit_original_response(embed=embed)
-            except discord.NotFound:
+                self.flush()
+            except Exception as e:
+                print(f"[Ошибка] Не удалось сбросить журнал событий: {e}")
+
+    def flush(self):
+        if not self._buffer:
+            return
+        events, self._buffer = self._buffer, []
+
+        if self._partitions is None:
+            self._partitions = set(self._existing_partitions())
+
+        by_day = {}
+        for event in events:
+            by_day.setdefault(int(event[0] // 86400), []).append(event)
+
+        for day, rows in by_day.items():
+            table = self.partition_name(day)
+            if table not in self._partitions:
+                db_writer.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        ts REAL,
+                        event_type INTEGER,
+                        user_id INTEGER,
+                        action_name TEXT,
+                        message TEXT,
+                        guild_id INTEGER
+                    )
+                ''')
+                self._partitions.add(table)
+            db_writer.executemany(
+                f"INSERT INTO {table} (ts, event_type, user_id, action_name, message, guild_id) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+        self._drop_expired(max(by_day))
+        activity_stats.record(events)
+
+    @staticmethod
+    def partition_name(day):
+        return "events_" + time.strftime("%Y%m%d", time.gmtime(day * 86400))
+
+    def _existing_partitions(self):
+        with read_pool.connection() as db:
+            rows = db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'events_%'").fetchall()
+        return [name for name, in rows]
+
+    def _drop_expired(self, today):
+        if self._retention_checked == today:
+            return
+        self._retention_checked = today
+
+        oldest = self.partition_name(today - LOG_RETENTION_DAYS)
+        for table in sorted(self._partitions):
+            if table < oldest:
+                db_writer.execute(f"DROP TABLE IF EXISTS {table}")
+                self._partitions.discard(table)
+                self.dropped_partitions += 1
+
+
+event_log = EventLog()
+atexit.register(event_log.flush)  # регистрируется после db_writer.close, значит выполнится раньше
+
+
+# --- Статистика активности ---
+STATS_RETENTION_DAYS = 400  # сколько дней хранятся суточные сводки по игрокам
+STATS_HOURLY_RETENTION_DAYS = 35  # почасовые сводки по действиям
+STATS_CACHE_TTL = 300  # сколько секунд сводка сервера отдаётся из памяти
+STATS_CACHE_SIZE = 500  # пар (сервер, период) в кэше
+STATS_TOP_SIZE = 10
+STATS_CUSTOM_ACTION = "Кастомный таймер"  # все кастомные таймеры — одна строка статистики
+STATS_PERIODS = {1: "за день", 7: "за неделю", 30: "за месяц"}
+STATS_NO_GUILD = 0  # запуски вне сервера и из журнала до колонки guild_id
+STATS_LEGACY_COLUMNS = {"stats_daily": "user_id, day, action_name, count", "stats_hourly": "hour, action_name, count"}
+
+STATS_DAILY_UPSERT = '''
+    INSERT INTO stats_daily (user_id, day, action_name, guild_id, count) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, day, action_name, guild_id) DO UPDATE SET count = count + excluded.count
+'''
+STATS_HOURLY_UPSERT = '''
+    INSERT INTO stats_hourly (guild_id, hour, action_name, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT (guild_id, hour, action_name) DO UPDATE SET count = count + excluded.count
+'''
+
+
+GuildStats = collections.namedtuple("GuildStats", "players actions by_action hours")
+
+class ActivityStats:
+    # Сколько раз игрок запускал каждое действие за сутки на каждом сервере и
+    # сколько запусков каждого действия было на сервере за час. Сводки пополняются
+    # той же пачкой DBWriter, что и журнал, поэтому команды не сканируют сами
+    # события. Сводка сервера за период кэшируется на STATS_CACHE_TTL.
+    def __init__(self):
+        self._guilds = collections.OrderedDict()  # (guild_id, days) -> (expires_at, GuildStats)
+        self._retention_checked = None
+
+    @staticmethod
+    def _count(daily, hourly, ts, user_id, action_name, guild_id):
+        if CUSTOM_TIMER_NAME.fullmatch(action_name):
+            action_name = STATS_CUSTOM_ACTION
+        guild_id = guild_id or STATS_NO_GUILD
+        daily[(user_id, int(ts // 86400), action_name, guild_id)] += 1
+        hourly[(guild_id, int(ts // 3600), action_name)] += 1
+
+    def record(self, events):
+        daily = collections.Counter()
+        hourly = collections.Counter()
+        for ts, event_type, user_id, action_name, _, guild_id in events:
+            if event_type == EventType.ACTION_USED and action_name:
+                self._count(daily, hourly, ts, user_id, action_name, guild_id)
+        if not daily:
+            return
+
+        db_writer.executemany(STATS_DAILY_UPSERT, [(*key, count) for key, count in daily.items()])
+        db_writer.executemany(STATS_HOURLY_UPSERT, [(*key, count) for key, count in hourly.items()])
+        self._drop_expired(max(key[1] for key in daily))
+
+    def _drop_expired(self, today):
+        if self._retention_checked == today:
+            return
+        self._retention_checked = today
+        db_writer.execute("DELETE FROM stats_daily WHERE day < ?", (today - STATS_RETENTION_DAYS,))
+        db_writer.execute("DELETE FROM stats_hourly WHERE hour < ?", ((today - STATS_HOURLY_RETENTION_DAYS) * 24,))
+
+    @staticmethod
+    def _first_day(days):
+        return int(time.time() // 86400) - days + 1
+
+    def player(self, user_id, days):
+        # Диапазон по первичному ключу: не больше days × число действий × серверов строк
+        with read_pool.connection() as db:
+            return db.execute('''
+                SELECT action_name, SUM(count) FROM stats_daily
+                WHERE user_id = ? AND day >= ?
+                GROUP BY action_name ORDER BY 2 DESC
+            ''', (user_id, self._first_day(days))).fetchall()
+
+    async def guild(self, guild_id, days):
+        now = time.time()
+        key = (guild_id, days)
+        cached = self._guilds.get(key)
+        if cached is not None and cached[0] > now:
+            self._guilds.move_to_end(key)
+            return cached[1]
+
+        # Чтение — в потоке: на большом сервере это тысячи строк за месяц
+        rows, hourly = await asyncio.to_thread(self._read_guild, guild_id, days)
+        players = collections.Counter()
+        actions = collections.Counter()
+        by_action = {}
+        for user_id, action_name, count in rows:
+            players[user_id] += count
+            actions[action_name] += count
+            by_action.setdefault(action_name, collections.Counter())[user_id] += count
+        hours = collections.Counter()
+        for hour, count in hourly:
+            hours[time.localtime(hour * 3600).tm_hour] += count
+
+        stats = GuildStats(players.most_common(), actions.most_common(), by_action, hours.most_common())
+        self._guilds[key] = (now + STATS_CACHE_TTL, stats)
+        self._guilds.move_to_end(key)
+        if len(self._guilds) > STATS_CACHE_SIZE:
+            self._guilds.popitem(last=False)
+        return stats
+
+    def _read_guild(self, guild_id, days):
+        # Оба запроса — диапазоны по индексу (guild_id, day) и ключу stats_hourly
+        first_day = self._first_day(days)
+        with read_pool.connection() as db:
+            rows = db.execute('''
+                SELECT user_id, action_name, SUM(count) FROM stats_daily
+                WHERE guild_id = ? AND day >= ? GROUP BY user_id, action_name
+            ''', (guild_id, first_day)).fetchall()
+            hourly = db.execute(
+                "SELECT hour, SUM(count) FROM stats_hourly WHERE guild_id = ? AND hour >= ? GROUP BY hour",
+                (guild_id, first_day * 24)
+            ).fetchall()
+        return rows, hourly
+
+    def backfill(self):
+        # Пересобирает сводки по журналу: старой таблице logs и суточным events_*.
+        # Сводки за дни старше журнала остаются как есть. Бот при этом должен быть
+        # остановлен, иначе его свежие события посчитаются дважды.
+        daily = collections.Counter()
+        hourly = collections.Counter()
+        partitions = sorted(event_log._existing_partitions())
+        events = 0
+
+        with read_pool.connection() as db:
+            rows = db.execute(
+                "SELECT timestamp, user_id, action_name, NULL FROM logs WHERE event_type = ?",
+                (EVENT_LABELS[EventType.ACTION_USED],)
+            )
+            while True:
+                chunk = rows.fetchmany(TIMER_LOAD_CHUNK)
+                if not chunk:
+                    break
+                for timestamp, user_id, action_name, guild_id in chunk:
+                    # Старый журнал писал местное время строкой
+                    try:
+                        ts = time.mktime(time.strptime(timestamp, "%Y-%m-%d %H:%M:%S"))
+                    except (TypeError, ValueError):
+                        continue
+                    if action_name:
+                        self._count(daily, hourly, ts, user_id, action_name, guild_id)
+                        events += 1
+
+            for table in partitions:
+                rows = db.execute(
+                    f"SELECT ts, user_id, action_name, guild_id FROM {table} WHERE event_type = ?",
+                    (int(EventType.ACTION_USED),)
+                )
+                while True:
+                    chunk = rows.fetchmany(TIMER_LOAD_CHUNK)
+                    if not chunk:
+                        break
+                    for ts, user_id, action_name, guild_id in chunk:
+                        if action_name:
+                            self._count(daily, hourly, ts, user_id, action_name, guild_id)
+                            events += 1
+
+        if not daily:
+            return 0
+        first_day = min(key[1] for key in daily)
+        db_writer.execute("DELETE FROM stats_daily WHERE day >= ?", (first_day,))
+        db_writer.execute("DELETE FROM stats_hourly WHERE hour >= ?", (first_day * 24,))
+        db_writer.executemany(STATS_DAILY_UPSERT, [(*key, count) for key, count in daily.items()])
+        db_writer.executemany(STATS_HOURLY_UPSERT, [(*key, count) for key, count in hourly.items()])
+        self._guilds.clear()
+        return events
+
+
+activity_stats = ActivityStats()
+
+
+def log_event(event_type: EventType, user_id: int, action_name: str = None, message: str = None, guild_id: int = None):
+    event_log.emit(event_type, user_id, action_name, message, guild_id)
+
+# --- Ограничение частоты ---
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def ready(self):
+        self._refill()
+        return self.tokens >= 1
+
+    def try_take(self):
+        if not self.ready():
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self):
+        # Через сколько секунд появится следующий токен
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    async def take(self):
+        while not self.try_take():
+            await asyncio.sleep(self.delay())
+
+
+class RateLimiter:
+    # Корзина на ключ (игрок, канал). Храним не больше size корзин: давно не
+    # трогавшиеся вытесняются — вернувшийся игрок просто получит полную корзину
+    def __init__(self, rate, capacity, size):
+        self.rate = rate
+        self.capacity = capacity
+        self.size = size
+        self._buckets = collections.OrderedDict()  # key -> TokenBucket, LRU
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def ready(self, key):
+        if self.bucket(key).ready():
+            return True
+        self.rejected += 1
+        return False
+
+
+# Лимиты на входе: игрок, канал (для текстовых команд — там ответ идёт
+# обычным сообщением в канал) и весь бот. Отказ стоит одного эфемерного
+# ответа на взаимодействие, а на текст — ничего.
+RATE_USER_RATE = 1  # действий игрока в секунду
+RATE_USER_BURST = 5
+RATE_CHANNEL_RATE = 0.5  # текстовых «меню» в секунду на канал
+RATE_CHANNEL_BURST = 3
+RATE_GLOBAL_RATE = 100  # взаимодействий в секунду на процесс; выше правки и ЛС упрутся в общий лимит Discord
+RATE_GLOBAL_BURST = 200
+RATE_BUCKETS = 10000
+
+user_limiter = RateLimiter(RATE_USER_RATE, RATE_USER_BURST, RATE_BUCKETS)
+channel_limiter = RateLimiter(RATE_CHANNEL_RATE, RATE_CHANNEL_BURST, RATE_BUCKETS)
+global_limiter = TokenBucket(RATE_GLOBAL_RATE, RATE_GLOBAL_BURST)
+global_rejected = 0
+
+
+def allow_request(user_id, channel_id=None):
+    # Сначала проверяем все корзины, потом списываем: отказ по каналу
+    # или общему лимиту не должен стоить игроку токена
+    global global_rejected
+    if not user_limiter.ready(user_id):
+        return False
+    if channel_id is not None and not channel_limiter.ready(channel_id):
+        return False
+    if not global_limiter.ready():
+        global_rejected += 1
+        return False
+
+    user_limiter.bucket(user_id).try_take()
+    if channel_id is not None:
+        channel_limiter.bucket(channel_id).try_take()
+    global_limiter.try_take()
+    return True
+
+
+async def admit(interaction: discord.Interaction):
+    # Дерево команд проверяет и подсказки автодополнения — это нажатия
+    # клавиш, а не действия игрока, токены на них не тратим
+    if interaction.type is discord.InteractionType.autocomplete:
+        return True
+    if allow_request(interaction.user.id):
+        return True
+    delay = max(1, round(user_limiter.bucket(interaction.user.id).delay()))
+    try:
+        await interaction.response.send_message(f"⏳ Слишком часто. Попробуйте через {delay} с.", ephemeral=True)
+    except discord.HTTPException:
+        pass
+    return False
+
+async def admit_player(interaction: discord.Interaction):
+    # Общая проверка меню, форм и кнопок: лимиты, затем таймеры игрока в памяти
+    if not await admit(interaction):
+        return False
+    ensure_user_loaded(interaction.user.id)
+    return True
+
+
+tree.interaction_check = admit
+
+
+# --- Фоновые задачи интерфейса ---
+class TaskRegistry:
+    # Задачи под присмотром: по ключу живёт не больше одной (новая отменяет
+    # старую), каждой отведён потолок времени жизни, ошибки не теряются.
+    # Ссылки держим здесь — голую create_task сборщик мусора может прибить.
+    def __init__(self, lifetime):
+        self._lifetime = lifetime
+        self._tasks = {}
+        self.started = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def spawn(self, key, coro):
+        self.cancel(key)
+        task = asyncio.create_task(self._supervise(coro))
+        task.add_done_callback(lambda done: self._forget(key, done))
+        self._tasks[key] = task
+        self.started += 1
+        return task
+
+    def cancel(self, key):
+        task = self._tasks.pop(key, None)
+        if task is not None and not task.done():
+            task.cancel()
+            self.cancelled += 1
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def _supervise(self, coro):
+        try:
+            await asyncio.wait_for(coro, timeout=self._lifetime)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            print(f"[Ошибка] Фоновая задача интерфейса не уложилась в {self._lifetime} с")
+        except Exception as e:
+            self.failed += 1
+            print(f"[Ошибка] Фоновая задача интерфейса упала: {e}")
+
+
+# --- Общий тикер обратных отсчётов ---
+COUNTDOWN_IDLE_TTL = 600  # сколько секунд обновляем открытое сообщение
+INTERACTION_TOKEN_TTL = 14 * 60  # токен взаимодействия живёт 15 минут, оставляем запас
+COUNTDOWN_EDIT_RATE = 5  # правок сообщений в секунду на весь бот
+COUNTDOWN_EDIT_BURST = 10
+COUNTDOWN_PER_USER = 5  # живых отсчётов на игрока, старые вытесняются
+COUNTDOWN_REFRESH_TIMEOUT = 30  # потолок на одну правку вместе с повторами discord.py
+
+
+def countdown_interval(remaining):
+    # Чем дальше дедлайн, тем реже перерисовываем
+    if remaining <= 60:
+        return 5
+    if remaining <= 3600:
+        return 60
+    if remaining <= 86400:
+        return 600
+    return 3600
+
+
+class CountdownTicker:
+    # Один цикл на все живые отсчёты вместо отдельной корутины на каждое сообщение.
+    # render() возвращает (kwargs для edit_original_response, ближайший дедлайн);
+    # дедлайн None означает, что отсчёт закончен и это последняя правка;
+    # kwargs None — содержимое не изменилось, правку пропускаем.
+    # С live=False промежуточных правок нет — только на самом дедлайне.
+    # Ключ — (игрок, view). Новое сообщение со списком или отсчётом снимает
+    # все прежние ключи игрока (drop_user), их правки в полёте отменяются.
+    def __init__(self):
+        self._heap = []  # (next_update, seq, key)
+        self._entries = {}  # (user_id, view) -> (interaction, render, expires_at, seq, live)
+        self._by_user = {}  # user_id -> OrderedDict ключей по времени открытия
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._budget = TokenBucket(COUNTDOWN_EDIT_RATE, COUNTDOWN_EDIT_BURST)
+        self._refreshes = TaskRegistry(COUNTDOWN_REFRESH_TIMEOUT)
+        self.edits = 0
+        self.deferred = 0
+        self.skipped = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def tasks(self):
+        return len(self._refreshes)
+
+    def track(self, interaction, render, end_time, view, live=True):
+        user_id = interaction.user.id
+        key = (user_id, view)
+        self._drop(key)
+
+        keys = self._by_user.get(user_id, ())
+        while len(keys) >= COUNTDOWN_PER_USER:
+            self._drop(next(iter(keys)))
+            self.evicted += 1
+        self._by_user.setdefault(user_id, collections.OrderedDict())[key] = None
+
+        # Токен взаимодействия умирает через 15 минут — дальше правки бессмысленны
+        expires_at = time.time() + min(COUNTDOWN_IDLE_TTL, INTERACTION_TOKEN_TTL)
+        entry = (interaction, render, expires_at, next(self._counter), live)
+        self._entries[key] = entry
+        self._schedule(key, entry, end_time)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def drop_user(self, user_id):
+        # Игрок получил новое сообщение со списком или отсчётом — прежние
+        # сообщения больше не правим, их правки в полёте отменяются
+        for key in list(self._by_user.get(user_id, ())):
+            self._drop(key)
+
+    def _drop(self, key):
+        self._refreshes.cancel(key)
+        if self._entries.pop(key, None) is None:
+            return
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def _schedule(self, key, entry, end_time):
+        now = time.time()
+        next_update = end_time
+        if entry[4]:
+            next_update = min(now + countdown_interval(end_time - now), end_time)
+        if next_update > entry[2]:
+            self._drop(key)
+            return
+
+        heapq.heappush(self._heap, (next_update, entry[3], key))
+        if self._heap[0][2] == key:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            # Пустая куча — ещё не конец: правка в полёте сама поставит следующий
+            # шаг через _schedule, поэтому ждём, а не выходим
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            next_update, seq, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry[3] != seq:
+                heapq.heappop(self._heap)
+                continue
+
+            delay = next_update - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Бюджет правок исчерпан — остальные обновления подождут
+            if not self._budget.try_take():
+                self.deferred += 1
+                await asyncio.sleep(self._budget.delay())
+                continue
+
+            heapq.heappop(self._heap)
+            self._refreshes.spawn(key, self._refresh(key, entry))
+
+    async def _refresh(self, key, entry):
+        interaction, render, expires_at = entry[:3]
+        if time.time() >= expires_at:
+            if self._entries.get(key) is entry:
+                self._drop(key)
+            return
+
+        kwargs, end_time = render()
+        if kwargs is None:
+            self.skipped += 1
+        else:
+            try:
+                await interaction.edit_original_response(**kwargs)
+                self.edits += 1
+            except discord.HTTPException:
+                if self._entries.get(key) is entry:
+                    self._drop(key)
                 return
 
-            await asyncio.sleep(10)
-            remaining = max(0, int(end_time - time.time()))
+        if self._entries.get(key) is not entry:
+            return
+        if end_time is None:
+            self._drop(key)
+            return
+        self._schedule(key, entry, end_time)
+
+
+countdown_ticker = CountdownTicker()
+
+
+# --- Базовое меню ---
+class BotView(ui.View):
+    async def interaction_check(self, interaction: discord.Interaction):
+        return await admit_player(interaction)
+
+    def bind_catalog(self, catalog, actions=(), handler=None):
+        # Кнопки действий из каталога идут первыми, навигация — после них.
+        # custom_id стабильные, поэтому кнопки продолжают работать после рестарта
+        self.catalog = catalog
+        navigation = list(self.children)
+        self.clear_items()
+        for action in actions:
+            button = ui.Button(
+                label=action.label,
+                style=action.style,
+                emoji=action.emoji,
+                custom_id=catalog.custom_id(f"action:{action.name}")
+            )
+            button.callback = functools.partial(handler, action=action)
+            self.add_item(button)
+        for item in navigation:
+            item.custom_id = catalog.custom_id(item.custom_id)
+            self.add_item(item)
+
+    def as_layout(self):
+        # Остановленный view — только разметка для отправки: discord.py не заводит
+        # под каждое сообщение запись в хранилище, а нажатия ловят экземпляры,
+        # зарегистрированные один раз в register_views()
+        self.stop()
+        return self
+
+
+# --- Меню фарма ---
+BULK_START_OPTIONS = 25  # столько вариантов Discord разрешает в одном списке
+BULK_START_EVENTS = {
+    "club": (EventType.CLUB_TASK, "Начато"),
+    "payment": (EventType.PROPERTY_PAYMENT, "Активировано"),
+}
 
-        embed.title = "✅ Теперь доступно!"
-        embed.description = f"Вы можете снова использовать: **{action_name}**"
-        embed.color = discord.Color.green()
-        await interaction.edit_original_response(embed=embed)
 
-    @ui.button(label="Схемы", style=ButtonStyle.primary, emoji="📘")
-    async def schemes(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_button_click(interaction, "Схемы")
+class FarmMenu(BotView):
+    def __init__(self, catalog):
+        super().__init__(timeout=None)
+        self.bind_catalog(catalog, catalog.menus["farm"], self.handle_button_click)
+        self.bulk_start_select.options = [
+            discord.SelectOption(label=action.label, value=action.name, emoji=action.emoji)
+            for action in list(catalog.actions.values())[:BULK_START_OPTIONS]
+        ]
+        self.bulk_start_select.max_values = len(self.bulk_start_select.options)
+
+    @metrics.timed("farm_action")
+    async def handle_button_click(self, interaction: discord.Interaction, action: Action):
+        user_id = interaction.user.id
+        action_name = action.name
 
-    @ui.button(label="Швейка", style=ButtonStyle.primary, emoji="🧵")
-    async def sewing(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_button_click(interaction, "Швейка")
+        if not is_action_available(user_id, action_name):
+            await self.show_countdown(interaction, action_name)
+            return
 
-    @ui.button(label="Волонтёрка", style=ButtonStyle.success, emoji="⛑️")
-    async def volunteer(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_button_click(interaction, "Волонтёрка")
+        record = timer_store.start(user_id, action_name, time.time(), action.cooldown)
+        save_timer_to_db(record, interaction.guild_id)
 
-    @ui.button(label="Скользкая", style=ButtonStyle.danger, emoji="🛢️")
-    async def slippery(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_button_click(interaction, "Скользкая")
+        notification_scheduler.add(user_id, action_name, record.end_time, self.catalog.guild_id)
 
-    @ui.button(label="Питомец", style=ButtonStyle.secondary, emoji="🐾")
-    async def pet(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_button_click(interaction, "Питомец")
+        await interaction.response.send_message(action.start_message, ephemeral=True)
 
-    @ui.button(label="Организация", style=ButtonStyle.primary, emoji="🏢")
-    async def organization(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_button_click(interaction, "Организация")
+    async def show_countdown(self, interaction: discord.Interaction, action_name: str):
+        user_id = interaction.user.id
+        record = timer_store.get(user_id, action_name)
+        started_at, end_time = record.started_at, record.end_time
+        mode = get_timer_mode(interaction.guild_id)
+
+        kwargs, deadline = self.render_countdown(action_name, started_at, end_time, mode)
+        countdown_ticker.drop_user(user_id)
+        await interaction.response.send_message(ephemeral=True, **kwargs)
+
+        if deadline is not None:
+            countdown_ticker.track(
+                interaction,
+                lambda: self.render_countdown(action_name, started_at, end_time, mode),
+                deadline,
+                ("countdown", action_name),
+                live=mode == TIMER_MODE_LIVE
+            )
 
-    @ui.button(label="Релог", style=ButtonStyle.danger, emoji="🔄")
-    async def relog(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_button_click(interaction, "Релог")
+    @staticmethod
+    def render_countdown(action_name, started_at, end_time, mode):
+        now = time.time()
+        remaining = max(0, int(end_time - now))
 
-    @ui.button(label="Задание клуба", style=ButtonStyle.primary, emoji="🎯")
+        if remaining <= 0:
+            embed = discord.Embed(
+                title="✅ Теперь доступно!",
+                description=f"Вы можете снова использовать: **{action_name}**",
+                color=discord.Color.green()
+            )
+            return {"embed": embed}, None
+
+        # Повтор в тихие часы стартует с их концом: до него полоса пустая
+        starts = f"\nОтсчёт начнётся в <t:{int(started_at)}:t>" if started_at > now else ""
+
+        if mode == TIMER_MODE_RELATIVE:
+            embed = discord.Embed(
+                title=f"⏳ Ожидание: {action_name}",
+                description=f"Доступно <t:{int(end_time)}:R> (<t:{int(end_time)}:T>){starts}",
+                color=discord.Color.orange()
+            )
+            return {"embed": embed}, end_time
+
+        hours, remainder = divmod(remaining, 3600)
+        mins, secs = divmod(remainder, 60)
+        timer_text = f"{hours} ч {mins} мин {secs} сек"
+
+        bar_length = 20
+        progress = max(0.0, min(1.0, 1 - remaining / (end_time - started_at)))
+        filled = int(bar_length * progress)
+        bar = '🟩' * filled + '🟥' * (bar_length - filled)
+
+        embed = discord.Embed(
+            title=f"⏳ Ожидание: {action_name}",
+            description=f"```\n{bar}\n```\nОсталось: **{timer_text}**{starts}",
+            color=discord.Color.orange()
+        )
+        return {"embed": embed}, end_time
+
+    @ui.button(label="Задание клуба", style=ButtonStyle.primary, emoji="🎯", custom_id="farm:club")
     async def club_task_button(self, interaction: discord.Interaction, button: ui.Button):
-        view = ClubTaskMenu(farm_view=self)
+        view = self.catalog.view("club")
         embed = discord.Embed(
             title="🎯 Задание клуба",
             description="Выберите задание:",
@@ -195,9 +2675,9 @@ class FarmMenu(ui.View):
         )
         await interaction.response.edit_message(embed=embed, view=view)
 
-    @ui.button(label="Оплата имущества", style=ButtonStyle.success, emoji="💰")
+    @ui.button(label="Оплата имущества", style=ButtonStyle.success, emoji="💰", custom_id="farm:payment")
     async def property_payment_button(self, interaction: discord.Interaction, button: ui.Button):
-        view = PaymentMenu(farm_view=self)
+        view = self.catalog.view("payment")
         embed = discord.Embed(
             title="💰 Оплата имущества",
             description="Выберите срок оплаты:",
@@ -205,44 +2685,64 @@ class FarmMenu(ui.View):
         )
         await interaction.response.edit_message(embed=embed, view=view)
 
-    @ui.button(label="Кастомный таймер", style=ButtonStyle.secondary, emoji="⏱️")
+    @ui.button(label="Кастомный таймер", style=ButtonStyle.secondary, emoji="⏱️", custom_id="farm:custom_timer")
     async def custom_timer_button(self, interaction: discord.Interaction, button: ui.Button):
         await interaction.response.send_modal(CustomTimerModal())
 
-    @ui.button(label="Посмотреть таймеры", style=ButtonStyle.secondary, emoji="⏱️")
+    @ui.button(label="Посмотреть таймеры", style=ButtonStyle.secondary, emoji="⏱️", custom_id="farm:timers")
     async def show_timers_button(self, interaction: discord.Interaction, button: ui.Button):
-        await self.show_current_timers(interaction)
+        await TimerMenu.show_current_timers(interaction, self.catalog)
 
-    async def show_current_timers(self, interaction: discord.Interaction):
-        user_id = interaction.user.id
-
-        if user_id not in last_used or not last_used[user_id]:
-            await interaction.response.send_message("✅ У вас нет активных таймеров.", ephemeral=True)
+    @ui.button(label="Мой круг", style=ButtonStyle.success, emoji="🔁", custom_id="farm:preset")
+    async def preset_button(self, interaction: discord.Interaction, button: ui.Button):
+        action_names = get_preset_from_db(interaction.user.id)
+        if not action_names:
+            await interaction.response.send_message(
+                "ℹ️ Выберите действия в списке «Запустить несколько» — выбор запомнится как ваш круг.",
+                ephemeral=True
+            )
             return
+        await self.start_many(interaction, action_names)
 
-        embed = discord.Embed(
-            title="⏱️ Ваши активные таймеры",
-            description="Используйте ❌ рядом с действием, чтобы отключить его",
-            color=discord.Color.orange()
-        )
-
-        view = TimerMenu(farm_view=self)
-
-        for action_name, timestamp in last_used[user_id].items():
-            cooldown = get_cooldown(action_name)
-            remaining = max(0, int(timestamp + cooldown - time.time()))
-            if remaining > 0:
-                hours, remainder = divmod(remaining, 3600)
-                mins, secs = divmod(remainder, 60)
-                timer_text = f"{hours} ч {mins} мин {secs} сек"
-                embed.add_field(
-                    name=f"⏳ {action_name}",
-                    value=f"Доступно через: `{timer_text}`",
-                    inline=False
-                )
-                view.add_delete_button(action_name)
+    @ui.select(placeholder="Запустить несколько…", custom_id="farm:bulk_start", min_values=1, max_values=1)
+    async def bulk_start_select(self, interaction: discord.Interaction, select: ui.Select):
+        # Экземпляр общий для всех игроков — выбор берём из самого нажатия
+        action_names = interaction.data.get("values", [])
+        save_preset_to_db(interaction.user.id, action_names)
+        await self.start_many(interaction, action_names)
 
-        await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+    @metrics.timed("bulk_start")
+    async def start_many(self, interaction: discord.Interaction, action_names):
+        user_id = interaction.user.id
+        now = time.time()
+        records = []
+        waiting = []
+
+        for action_name in action_names:
+            action = self.catalog.actions.get(action_name)
+            if action is None:
+                continue
+            if not is_action_available(user_id, action_name):
+                waiting.append(action_name)
+                continue
+            records.append(timer_store.start(user_id, action_name, now, action.cooldown))
+            event = BULK_START_EVENTS.get(action.menu)
+            if event is not None:
+                log_event(event[0], user_id, action_name, event[1])
+
+        if records:
+            save_timers_to_db([(record, interaction.guild_id) for record in records])
+            notification_scheduler.add_many([
+                (user_id, record.action_name, record.end_time, self.catalog.guild_id) for record in records
+            ])
+
+        lines = []
+        if records:
+            lines.append("✅ Запущено: " + ", ".join(f"**{record.action_name}**" for record in records))
+        for action_name in waiting:
+            hours, remainder = divmod(get_remaining_time(user_id, action_name), 3600)
+            lines.append(f"⏳ **{action_name}** — ещё {hours} ч {remainder // 60} мин")
+        await interaction.response.send_message("\n".join(lines) or "❌ Нечего запускать.", ephemeral=True)
 
 
 # --- CustomTimerModal ---
@@ -252,9 +2752,14 @@ class CustomTimerModal(ui.Modal, title="⏰ Настройте кастомны
     minutes = ui.TextInput(label="Минуты", placeholder="Например: 30", required=False, default="0")
 
     def __init__(self):
-        super().__init__()
+        # Незакрытые окна иначе навсегда остаются в хранилище discord.py
+        super().__init__(timeout=600)
         self.view = None
 
+    async def interaction_check(self, interaction: discord.Interaction):
+        return await admit_player(interaction)
+
+    @metrics.timed("custom_timer")
     async def on_submit(self, interaction: discord.Interaction):
         try:
             d = int(self.days.value or 0)
@@ -267,19 +2772,15 @@ class CustomTimerModal(ui.Modal, title="⏰ Настройте кастомны
                 await interaction.response.send_message("❌ Укажите время больше нуля.", ephemeral=True)
                 return
 
-            action_name = f"Кастомный таймер ({d} дн {h} ч {m} мин)"
+            action_name = custom_timer_name(d, h, m)
             user_id = interaction.user.id
 
-            last_used.setdefault(user_id, {})[action_name] = time.time()
-            save_timer_to_db(user_id, action_name)
+            record = timer_store.start(user_id, action_name, time.time(), total_seconds, TimerKind.CUSTOM)
+            save_timer_to_db(record, interaction.guild_id)
 
-            pending_notifications.append({
-                "user_id": user_id,
-                "action_name": action_name,
-                "end_time": time.time() + total_seconds
-            })
+            notification_scheduler.add(user_id, action_name, record.end_time)
 
-            log_event("Кастомный таймер", user_id, action_name, "Активировано")
+            log_event(EventType.CUSTOM_TIMER, user_id, action_name, "Активировано")
 
             embed = discord.Embed(
                 title=f"⏱️ {action_name}",
@@ -293,152 +2794,318 @@ class CustomTimerModal(ui.Modal, title="⏰ Настройте кастомны
 
 
 # --- Таймеры с кнопкой ❌ ---
-class TimerMenu(ui.View):
-    def __init__(self, farm_view):
-        super().__init__(timeout=None)
-        self.farm_view = farm_view
-
-    def add_delete_button(self, action_name: str):
-        button = ui.Button(
+TIMER_MENU_DELETE_BUTTONS = 15  # три ряда ❌; остальные таймеры отключаются через список
+TIMER_RENDER_CACHE_SIZE = 2000  # игроков, чей последний список держим собранным
+class DeleteTimerButton(ui.DynamicItem[ui.Button], template=r"catalog:(?P<guild_id>\d+):timers:delete:(?P<action_name>.+)"):
+    # Набор ❌ у каждого игрока свой, поэтому название действия едет прямо в custom_id
+    def __init__(self, catalog, action_name):
+        super().__init__(ui.Button(
             label=f"❌ {action_name}",
             style=ButtonStyle.danger,
-            custom_id=f"delete_{action_name}"
-        )
-        async def delete_callback(interaction: discord.Interaction):
-            user_id = interaction.user.id
-            if user_id in last_used and action_name in last_used[user_id]:
-                del last_used[user_id][action_name]
-                cursor.execute("DELETE FROM user_timers WHERE user_id=? AND action=?", (user_id, action_name))
-                conn.commit()
-                log_event("Таймер удалён", user_id, action_name, "Таймер отключён вручную")
-                await interaction.response.send_message(f"✅ Таймер `{action_name}` отключён.", ephemeral=True)
-                await self.update_timer_embed(interaction)
-            else:
-                await interaction.response.send_message("❌ Это действие уже удалено.", ephemeral=True)
-        button.callback = delete_callback
-        self.add_item(button)
-
-    @ui.button(label="⬅️ Вернуться", style=ButtonStyle.secondary, emoji="⬅️")
+            custom_id=catalog.custom_id(f"timers:delete:{action_name}")
+        ))
+        self.catalog = catalog
+        self.action_name = action_name
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: ui.Button, match):
+        return cls(get_catalog(int(match["guild_id"]) or None), match["action_name"])
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return await admit_player(interaction)
+
+    async def callback(self, interaction: discord.Interaction):
+        user_id = interaction.user.id
+        action_name = self.action_name
+        if timer_store.remove(user_id, action_name):
+            notification_scheduler.cancel(user_id, action_name)
+            delete_timer_from_db(user_id, action_name)
+            log_event(EventType.TIMER_DELETED, user_id, action_name, "Таймер отключён вручную")
+            await interaction.response.send_message(f"✅ Таймер `{action_name}` отключён.", ephemeral=True)
+            await TimerMenu.update_timer_embed(interaction, self.catalog)
+        else:
+            await interaction.response.send_message("❌ Это действие уже удалено.", ephemeral=True)
+
+
+class TimerMenu(BotView):
+    # actions=None — обработчик для register_views(), со списком — разметка конкретного игрока
+    def __init__(self, catalog, actions=None):
+        super().__init__(timeout=None)
+        self.bind_catalog(catalog)
+        self.actions = list(actions or ())
+        if actions is None:
+            return
+
+        if not self.actions:
+            self.remove_item(self.reset_all_button)
+            self.remove_item(self.cancel_select)
+            return
+
+        self.cancel_select.options = [
+            discord.SelectOption(label=action_name[:100], value=action_name)
+            for action_name in self.actions[:BULK_START_OPTIONS]
+        ]
+        self.cancel_select.max_values = len(self.cancel_select.options)
+        for action_name in self.actions[:TIMER_MENU_DELETE_BUTTONS]:
+            self.add_item(DeleteTimerButton(catalog, action_name))
+
+    @ui.button(label="⬅️ Вернуться", style=ButtonStyle.secondary, emoji="⬅️", custom_id="timers:back")
     async def back_button(self, interaction: discord.Interaction, button: ui.Button):
         embed = discord.Embed(
             title="🌾 Фарм GTA V RP",
             description="Выберите тип фарма:",
             color=discord.Color.green()
         )
-        view = self.farm_view
+        view = self.catalog.view("farm")
         await interaction.response.edit_message(embed=embed, view=view)
 
-    async def update_timer_embed(self, interaction: discord.Interaction):
+    @ui.button(label="Сбросить все", style=ButtonStyle.danger, emoji="🧹", custom_id="timers:reset_all")
+    async def reset_all_button(self, interaction: discord.Interaction, button: ui.Button):
+        action_names = [action_name for action_name, _ in timer_store.active_timers(interaction.user.id, time.time())]
+        await self.cancel_many(interaction, action_names)
+
+    @ui.select(placeholder="Отключить несколько…", custom_id="timers:cancel", min_values=1, max_values=1)
+    async def cancel_select(self, interaction: discord.Interaction, select: ui.Select):
+        await self.cancel_many(interaction, interaction.data.get("values", []))
+
+    @metrics.timed("bulk_cancel")
+    async def cancel_many(self, interaction: discord.Interaction, action_names):
+        user_id = interaction.user.id
+        removed = [action_name for action_name in action_names if timer_store.remove(user_id, action_name)]
+        if removed:
+            notification_scheduler.cancel_many([(user_id, action_name) for action_name in removed])
+            delete_timers_from_db(user_id, removed)
+            log_event(EventType.TIMER_DELETED, user_id, ", ".join(removed), f"Отключено таймеров: {len(removed)}")
+
+        # Один ответ: то же сообщение сразу с новым списком
+        kwargs, _ = timer_renderer.render(self.catalog, user_id, get_timer_mode(interaction.guild_id))
+        await interaction.response.edit_message(**kwargs)
+
+    @staticmethod
+    async def show_current_timers(interaction: discord.Interaction, catalog):
+        user_id = interaction.user.id
+        countdown_ticker.drop_user(user_id)
+
+        if not timer_store.has_timers(user_id):
+            await interaction.response.send_message("✅ У вас нет активных таймеров.", ephemeral=True)
+            return
+
+        kwargs, _ = timer_renderer.render(catalog, user_id, get_timer_mode(interaction.guild_id))
+        await interaction.response.send_message(ephemeral=True, **kwargs)
+
+    @staticmethod
+    async def update_timer_embed(interaction: discord.Interaction, catalog):
         user_id = interaction.user.id
-        current_time = time.time()
+        mode = get_timer_mode(interaction.guild_id)
+        sent = {}
+
+        def render():
+            # Тот же объект из кэша рендера — в этом сообщении уже показано ровно это
+            kwargs, deadline = timer_renderer.render(catalog, user_id, mode)
+            if kwargs is sent.get("kwargs"):
+                return None, deadline
+            sent["kwargs"] = kwargs
+            return kwargs, deadline
+
+        kwargs, deadline = render()
+        countdown_ticker.drop_user(user_id)
+        try:
+            await interaction.edit_original_response(**kwargs)
+        except discord.NotFound:
+            return
+
+        if deadline is not None:
+            countdown_ticker.track(interaction, render, deadline, "timers", live=mode == TIMER_MODE_LIVE)
+
+
+class TimerListRenderer:
+    # Один рендер списка таймеров на /таймеры, «Посмотреть таймеры» и живое
+    # обновление. Embed и view кэшируются по игроку и собираются заново, только
+    # если поменялись строки списка: таймер запущен или снят, истёк, или отсчёт
+    # перешёл границу отображения (см. timer_field_value).
+    def __init__(self, size):
+        self._size = size
+        self._cache = collections.OrderedDict()  # (user_id, guild_id, mode) -> (строки, kwargs)
+        self.renders = 0
+        self.hits = 0
+
+    def render(self, catalog, user_id, mode):
+        active = timer_store.active_timers(user_id, time.time())
+        fields = tuple((action_name, timer_field_value(end_time, mode)) for action_name, end_time in active)
+        deadline = min((end_time for _, end_time in active), default=None)
+
+        key = (user_id, catalog.guild_id, mode)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == fields:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[1], deadline
 
         embed = discord.Embed(
             title="⏱️ Ваши активные таймеры",
             description="Используйте ❌ рядом с действием, чтобы отключить его",
             color=discord.Color.orange()
         )
+        for action_name, value in fields:
+            embed.add_field(name=f"⏳ {action_name}", value=value, inline=False)
 
-        has_active = False
-
-        for action_name, timestamp in last_used.get(user_id, {}).items():
-            cooldown = get_cooldown(action_name)
-            remaining = max(0, int(timestamp + cooldown - current_time))
-
-            if remaining > 0:
-                hours, remainder = divmod(remaining, 3600)
-                mins, secs = divmod(remainder, 60)
-                timer_text = f"{hours} ч {mins} мин {secs} сек"
-                embed.add_field(
-                    name=f"⏳ {action_name}",
-                    value=f"Доступно через: `{timer_text}`",
-                    inline=False
-                )
-                has_active = True
-
-        if not has_active:
+        if not fields:
             embed.title = "✅ Все действия доступны"
             embed.description = ""
             embed.add_field(name="🎉", value="Нет активных таймеров.")
             embed.color = discord.Color.green()
 
-        new_view = TimerMenu(farm_view=self.farm_view)
-        for act, ts in last_used.get(user_id, {}).items():
-            cooldown = get_cooldown(act)
-            if ts + cooldown > time.time():
-                new_view.add_delete_button(act)
+        # Новый набор кнопок нужен только когда изменился список активных таймеров
+        actions = [action_name for action_name, _ in fields]
+        if cached is not None and cached[1]["view"].actions == actions:
+            view = cached[1]["view"]
+        else:
+            view = TimerMenu(catalog, actions).as_layout()
+
+        kwargs = {"embed": embed, "view": view}
+        self._cache[key] = (fields, kwargs)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._size:
+            self._cache.popitem(last=False)
+        self.renders += 1
+        return kwargs, deadline
+
+
+timer_renderer = TimerListRenderer(TIMER_RENDER_CACHE_SIZE)
+
+
+# --- Настройки доставки ---
+DELIVERY_NOW = "now"  # сразу, с окном склейки DM_MERGE_WINDOW
+DELIVERY_DIGEST = "digest"  # одним сообщением раз в digest_minutes
+DELIVERY_LATEST = "latest"  # как «сразу», но в сообщении только последний истёкший таймер
+
+DeliveryPrefs = collections.namedtuple("DeliveryPrefs", "mode digest_minutes quiet_start quiet_end utc_offset")
+DELIVERY_DEFAULT = DeliveryPrefs(DELIVERY_NOW, 30, None, None, 3)  # пояс по умолчанию — МСК
+
+
+def in_quiet_hours(prefs, now):
+    if prefs.quiet_start is None or prefs.quiet_start == prefs.quiet_end:
+        return False
+    hour = int((now + prefs.utc_offset * 3600) // 3600 % 24)
+    if prefs.quiet_start < prefs.quiet_end:
+        return prefs.quiet_start <= hour < prefs.quiet_end
+    return hour >= prefs.quiet_start or hour < prefs.quiet_end
+
+def quiet_hours_end(prefs, now):
+    # Ближайший конец тихих часов по времени игрока
+    local = now + prefs.utc_offset * 3600
+    quiet_end = local // 86400 * 86400 + prefs.quiet_end * 3600
+    if quiet_end <= local:
+        quiet_end += 86400
+    return quiet_end - prefs.utc_offset * 3600
+
+def delivery_time(prefs, now):
+    send_at = now + DM_MERGE_WINDOW
+    if prefs.mode == DELIVERY_DIGEST:
+        period = prefs.digest_minutes * 60
+        send_at = max(send_at, (now // period + 1) * period)
+    if in_quiet_hours(prefs, send_at):
+        send_at = quiet_hours_end(prefs, send_at)
+    return send_at
+
+def delivery_text(prefs):
+    mode = {
+        DELIVERY_NOW: "сразу",
+        DELIVERY_DIGEST: f"дайджест раз в {prefs.digest_minutes} мин",
+        DELIVERY_LATEST: "только последнее",
+    }[prefs.mode]
+    quiet = "нет"
+    if prefs.quiet_start is not None and prefs.quiet_start != prefs.quiet_end:
+        quiet = f"с {prefs.quiet_start:02d}:00 до {prefs.quiet_end:02d}:00"
+    return f"📬 Напоминания: **{mode}**, тихие часы: **{quiet}** (UTC{prefs.utc_offset:+d})"
 
-        try:
-            await interaction.edit_original_response(embed=embed, view=new_view)
-        except discord.NotFound:
-            return
 
-        while True:
-            if not self.is_message_valid(interaction):
-                return
-
-            updated_embed = discord.Embed(
-                title="⏱️ Ваши активные таймеры",
-                description="Используйте ❌ рядом с действием, чтобы отключить его",
-                color=discord.Color.orange()
-            )
+# --- Уведомления с кнопкой 🗑️ ---
+NOTIFY_SNOOZE = 600  # на сколько секунд откладывает кнопка ⏰
+NOTIFY_ACTION_BUTTONS = 10  # действий в одном ЛС, для которых рисуем ⏰ и ⏹
 
-            for action_name, timestamp in list(last_used.get(user_id, {}).items()):
-                cooldown = get_cooldown(action_name)
-                remaining = max(0, int(timestamp + cooldown - time.time()))
-
-                if remaining > 0:
-                    hours, remainder = divmod(remaining, 3600)
-                    mins, secs = divmod(remainder, 60)
-                    timer_text = f"{hours} ч {mins} мин {secs} сек"
-                    updated_embed.add_field(
-                        name=f"⏳ {action_name}",
-                        value=f"Доступно через: `{timer_text}`",
-                        inline=False
-                    )
 
-            try:
-                await interaction.edit_original_response(embed=updated_embed, view=new_view)
-            except discord.NotFound:
-                return
+class NotificationView(BotView):
+    # Одна кнопка на все уведомления: игрок берётся из нажатия. К моменту
+    # отправки напоминание уже снято с расписания, отменять нечего.
+    # С items — разметка конкретного ЛС: ⏰ и ⏹ по каждому действию в нём
+    def __init__(self, items=()):
+        super().__init__(timeout=None)
+        for action_name, routine in items[:NOTIFY_ACTION_BUTTONS]:
+            self.add_item(NotificationTimerButton("snooze", action_name))
+            if routine:
+                self.add_item(NotificationTimerButton("stop", action_name))
 
-            await asyncio.sleep(1)
+    @ui.button(label="🗑️ Удалить", style=ButtonStyle.danger, custom_id="notify:dismiss")
+    async def delete_notification(self, interaction: discord.Interaction, button: ui.Button):
+        await interaction.message.delete()
+        log_event(EventType.NOTIFICATION_DISMISSED, interaction.user.id, None, "Уведомление скрыто игроком")
+
+
+@functools.lru_cache(maxsize=1024)
+def notification_layout(items):
+    # items: ((название, есть ли повтор или цепочка), ...) — одинаковые ЛС делят разметку
+    return NotificationView(items).as_layout()
+
+
+class NotificationTimerButton(ui.DynamicItem[ui.Button], template=r"notify:(?P<op>snooze|stop):(?P<action_name>.+)"):
+    # ⏰ — напомнить ещё раз через NOTIFY_SNOOZE, ⏹ — выключить повтор и цепочку.
+    # Если повтор уже перезапустил таймер, обе кнопки его снимают: игрок не успел
+    def __init__(self, op, action_name):
+        if op == "snooze":
+            button = ui.Button(label=f"⏰ {action_name}: +{NOTIFY_SNOOZE // 60} мин", style=ButtonStyle.secondary)
+        else:
+            button = ui.Button(label=f"⏹ {action_name}: стоп", style=ButtonStyle.secondary)
+        button.custom_id = f"notify:{op}:{action_name}"
+        super().__init__(button)
+        self.op = op
+        self.action_name = action_name
 
-    def is_message_valid(self, interaction: discord.Interaction):
-        try:
-            message = interaction.message or interaction.original_response()
-            return message is not None
-        except Exception as e:
-            return False
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: ui.Button, match):
+        return cls(match["op"], match["action_name"])
 
+    async def interaction_check(self, interaction: discord.Interaction):
+        return await admit_player(interaction)
 
-# --- Уведомления с кнопкой 🗑️ ---
-class NotificationView(ui.View):
-    def __init__(self, user_id, action_name):
-        super().__init__(timeout=None)
-        self.user_id = user_id
-        self.action_name = action_name
+    async def callback(self, interaction: discord.Interaction):
+        user_id = interaction.user.id
+        action_name = self.action_name
+        routine = get_routine_from_db(user_id, action_name)
 
-    @ui.button(label="🗑️ Удалить", style=ButtonStyle.danger)
-    async def delete_notification(self, interaction: discord.Interaction, button: ui.Button):
-        await interaction.message.delete()
+        if routine is not None and routine.repeat and timer_store.remove(user_id, action_name):
+            delete_timer_from_db(user_id, action_name)
+            notification_scheduler.cancel(user_id, action_name)
 
-        for notify in pending_notifications:
-            if notify.get("user_id") == self.user_id and notify.get("action_name") == self.action_name:
-                pending_notifications.remove(notify)
-                break
+        if self.op == "snooze":
+            if not is_action_available(user_id, action_name):
+                await interaction.response.send_message(
+                    f"⏳ Таймер «{action_name}» уже идёт — напомню, когда истечёт.", ephemeral=True
+                )
+                return
+            # В ЛС сервера нет: текст берём из каталога, где заведён повтор, если он есть
+            guild_id = routine.guild_id if routine is not None else None
+            notification_scheduler.add(user_id, action_name, time.time() + NOTIFY_SNOOZE, guild_id)
+            await interaction.response.send_message(
+                f"⏰ Напомню про «{action_name}» через {NOTIFY_SNOOZE // 60} мин.", ephemeral=True
+            )
+            return
 
-        print(f"[LOG] Уведомление `{self.action_name}` удалено пользователем {self.user_id}")
-        print(f"[LOG] Уведомление скрыто игроком")
+        delete_routine_from_db(user_id, action_name)
+        log_event(EventType.TIMER_DELETED, user_id, action_name, "Повтор остановлен из уведомления")
+        await interaction.response.send_message(f"⏹ Повтор и цепочка «{action_name}» выключены.", ephemeral=True)
 
 
 # --- Подменю "Задание клуба" ---
-class ClubTaskMenu(ui.View):
-    def __init__(self, farm_view):
+class ClubTaskMenu(BotView):
+    def __init__(self, catalog):
         super().__init__(timeout=None)
-        self.farm_view = farm_view
+        self.bind_catalog(catalog, catalog.menus["club"], self.handle_task_click)
 
-    async def handle_task_click(self, interaction: discord.Interaction, task_name: str):
+    @metrics.timed("club_task")
+    async def handle_task_click(self, interaction: discord.Interaction, action: Action):
         user_id = interaction.user.id
+        task_name = action.name
 
         if not is_action_available(user_id, task_name):
             remaining = get_remaining_time(user_id, task_name)
@@ -450,56 +3117,34 @@ class ClubTaskMenu(ui.View):
             )
             return
 
-        last_used.setdefault(user_id, {})[task_name] = time.time()
-        save_timer_to_db(user_id, task_name)
+        record = timer_store.start(user_id, task_name, time.time(), action.cooldown)
+        save_timer_to_db(record, interaction.guild_id)
 
-        pending_notifications.append({
-            "user_id": user_id,
-            "action_name": task_name,
-            "end_time": time.time() + 7200  # 2 часа для всех заданий клуба
-        })
-        log_event("Использование задания", user_id, task_name, "Начато")
-        await interaction.response.send_message(f"✅ Вы начали задание: **{task_name}**", ephemeral=True)
+        notification_scheduler.add(user_id, task_name, record.end_time, self.catalog.guild_id)
+        log_event(EventType.CLUB_TASK, user_id, task_name, "Начато")
+        await interaction.response.send_message(action.start_message, ephemeral=True)
 
-    @ui.button(label="Moto", style=ButtonStyle.primary, emoji="🏍️")
-    async def moto(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_task_click(interaction, "Moto")
-
-    @ui.button(label="Car Meet", style=ButtonStyle.primary, emoji="🚗")
-    async def car_meet(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_task_click(interaction, "Car Meet")
-
-    @ui.button(label="Rednecks", style=ButtonStyle.primary, emoji="🤠")
-    async def rednecks(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_task_click(interaction, "Rednecks")
-
-    @ui.button(label="The Epsilon Program", style=ButtonStyle.success, emoji="🌀")
-    async def epsilon(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_task_click(interaction, "The Epsilon Program")
-
-    @ui.button(label="Merryweather", style=ButtonStyle.danger, emoji="👮‍♂️")
-    async def merryweather(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_task_click(interaction, "Merryweather")
-
-    @ui.button(label="⬅️ Назад", style=ButtonStyle.secondary, emoji="⬅️")
+    @ui.button(label="⬅️ Назад", style=ButtonStyle.secondary, emoji="⬅️", custom_id="menu:back")
     async def back_to_farm(self, interaction: discord.Interaction, button: ui.Button):
         embed = discord.Embed(
             title="🌾 Фарм GTA V RP",
             description="Выберите тип фарма:",
             color=discord.Color.green()
         )
-        view = self.farm_view
+        view = self.catalog.view("farm")
         await interaction.response.edit_message(embed=embed, view=view)
 
 
 # --- Подменю "Оплата имущества" ---
-class PaymentMenu(ui.View):
-    def __init__(self, farm_view):
+class PaymentMenu(BotView):
+    def __init__(self, catalog):
         super().__init__(timeout=None)
-        self.farm_view = farm_view
+        self.bind_catalog(catalog, catalog.menus["payment"], self.handle_payment_click)
 
-    async def handle_payment_click(self, interaction: discord.Interaction, payment_name: str, cooldown: int):
+    @metrics.timed("property_payment")
+    async def handle_payment_click(self, interaction: discord.Interaction, action: Action):
         user_id = interaction.user.id
+        payment_name = action.name
 
         if not is_action_available(user_id, payment_name):
             remaining = get_remaining_time(user_id, payment_name)
@@ -511,34 +3156,22 @@ class PaymentMenu(ui.View):
             )
             return
 
-        last_used.setdefault(user_id, {})[payment_name] = time.time()
-        save_timer_to_db(user_id, payment_name)
-
-        pending_notifications.append({
-            "user_id": user_id,
-            "action_name": payment_name,
-            "end_time": time.time() + cooldown
-        })
-        log_event("Оплата имущества", user_id, payment_name, "Активировано")
+        record = timer_store.start(user_id, payment_name, time.time(), action.cooldown)
+        save_timer_to_db(record, interaction.guild_id)
 
-        await interaction.response.send_message(f"✅ Вы начали: **{payment_name}**", ephemeral=True)
+        notification_scheduler.add(user_id, payment_name, record.end_time, self.catalog.guild_id)
+        log_event(EventType.PROPERTY_PAYMENT, user_id, payment_name, "Активировано")
 
-    @ui.button(label="Оплата на 6 дней", style=ButtonStyle.primary, emoji="📆")
-    async def pay_6(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_payment_click(interaction, "Оплата на 6 дней", 5 * 86400)  # 5 дней (оплачено на 6)
+        await interaction.response.send_message(action.start_message, ephemeral=True)
 
-    @ui.button(label="Оплата на 29 дней", style=ButtonStyle.success, emoji="📅")
-    async def pay_29(self, interaction: discord.Interaction, button: ui.Button):
-        await self.handle_payment_click(interaction, "Оплата на 29 дней", 29 * 86400)
-
-    @ui.button(label="⬅️ Назад", style=ButtonStyle.secondary, emoji="⬅️")
+    @ui.button(label="⬅️ Назад", style=ButtonStyle.secondary, emoji="⬅️", custom_id="menu:back")
     async def back_to_farm(self, interaction: discord.Interaction, button: ui.Button):
         embed = discord.Embed(
             title="🌾 Фарм GTA V RP",
             description="Выберите тип фарма:",
             color=discord.Color.green()
         )
-        view = self.farm_view
+        view = self.catalog.view("farm")
         await interaction.response.edit_message(embed=embed, view=view)
 
 
@@ -550,122 +3183,642 @@ async def farm_command(interaction: discord.Interaction):
         description="Выберите тип фарма:",
         color=discord.Color.green()
     )
-    view = FarmMenu()
+    view = get_catalog(interaction.guild_id).view("farm")
     await interaction.response.send_message(embed=embed, view=view, ephemeral=False)
 
 
 @tree.command(name="таймеры", description="Показывает оставшееся время по всем вашим действиям")
 async def show_timers(interaction: discord.Interaction):
-    user_id = interaction.user.id
+    ensure_user_loaded(interaction.user.id)
+    await TimerMenu.show_current_timers(interaction, get_catalog(interaction.guild_id))
+
+
+@tree.command(name="режим_таймеров", description="Как показывать обратный отсчёт таймеров на этом сервере")
+@app_commands.describe(mode="Живой отсчёт правит сообщения, отсчёт Discord считается в клиенте")
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Живой отсчёт", value=TIMER_MODE_LIVE),
+    app_commands.Choice(name="Отсчёт Discord (без правок)", value=TIMER_MODE_RELATIVE)
+])
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.guild_only()
+async def timer_mode_command(interaction: discord.Interaction, mode: app_commands.Choice[str]):
+    guild_timer_modes[interaction.guild_id] = mode.value
+    save_timer_mode_to_db(interaction.guild_id, mode.value)
+    log_event(EventType.TIMER_MODE, interaction.user.id, None, f"Сервер {interaction.guild_id}: {mode.value}")
+    await interaction.response.send_message(f"✅ Режим таймеров: **{mode.name}**", ephemeral=True)
+
+
+owner_ids = None
+
+
+async def is_bot_owner(user):
+    global owner_ids
+    if owner_ids is None:
+        app = await bot.application_info()
+        owner_ids = {member.id for member in app.team.members} if app.team else {app.owner.id}
+    return user.id in owner_ids
+
+
+@tree.command(name="метрики", description="Задержки обработчиков, очереди и профилировщик (только владелец бота)")
+@app_commands.describe(profiling="Включить или выключить профилировщик")
+@app_commands.rename(profiling="профилировщик")
+async def metrics_command(interaction: discord.Interaction, profiling: bool = None):
+    if not await is_bot_owner(interaction.user):
+        await interaction.response.send_message("❌ Команда доступна только владельцу бота.", ephemeral=True)
+        return
+
+    if profiling is True:
+        profiler.start()
+    elif profiling is False:
+        profiler.stop()
+
+    lines = []
+    if not metrics.enabled:
+        lines.append("Метрики выключены, включаются переменной BOT_METRICS=1.")
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        label = ", ".join(str(value) for _, value in labels) or name
+        lines.append(
+            f"**{label}**: {histogram.count} шт., p50 ≤ {histogram.quantile(0.5) * 1000:g} мс, "
+            f"p99 ≤ {histogram.quantile(0.99) * 1000:g} мс"
+        )
+    for (name, labels), value in sorted(metrics.counters.items()):
+        lines.append(f"{name}{Metrics._labels(labels)}: {value}")
+    for name, func in sorted(metrics.gauges.items()):
+        lines.append(f"{name}: {func()}")
+
+    lines.append(f"Профилировщик: {'включён' if profiler.running else 'выключен'}")
+    for stack, share in profiler.top(5):
+        # Три самых глубоких кадра — обычно этого хватает, чтобы узнать горячее место
+        lines.append(f"`{share:.0%}` " + " ← ".join(reversed(stack.split(";")[-3:])))
 
-    if user_id not in last_used or not last_used[user_id]:
-        await interaction.response.send_message("✅ У вас нет активных таймеров.", ephemeral=True)
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+
+@tree.command(name="снимок", description="Снимок базы и таймеров без остановки бота (только владелец бота)")
+async def snapshot_command(interaction: discord.Interaction):
+    if not await is_bot_owner(interaction.user):
+        await interaction.response.send_message("❌ Команда доступна только владельцу бота.", ephemeral=True)
         return
 
-    embed = discord.Embed(
-        title="⏱️ Ваши активные таймеры",
-        description="Используйте ❌ рядом с действием, чтобы отключить его",
-        color=discord.Color.orange()
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        report = await asyncio.to_thread(make_snapshot, snapshot_changes())
+    except (OSError, sqlite3.Error) as e:
+        report = f"❌ Снимок не сделан: {e}"
+    await interaction.followup.send(report, ephemeral=True)
+
+
+@tree.command(name="перезагрузить_действия", description="Перечитать каталог действий сервера без перезапуска бота")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.guild_only()
+async def reload_actions_command(interaction: discord.Interaction):
+    # Администратор сервера перечитывает только actions.<id сервера>.json;
+    # общий actions.json и каталоги остальных серверов — только владелец бота
+    owner = await is_bot_owner(interaction.user)
+    try:
+        if owner:
+            loaded = load_catalogs()
+        else:
+            catalog = load_guild_catalog(interaction.guild_id)
+        register_views()
+    except (OSError, ValueError, KeyError) as e:
+        await interaction.response.send_message(f"❌ Каталог не загружен, остался прежний: {e}", ephemeral=True)
+        return
+
+    if owner:
+        report = f"✅ Все каталоги перезагружены, переопределений серверов: {len(loaded) - 1}"
+    elif catalog.guild_id is None:
+        report = "✅ Своего каталога у сервера нет, действует общий"
+    else:
+        report = "✅ Каталог сервера перезагружен"
+    await interaction.response.send_message(
+        f"{report}: {len(get_catalog(interaction.guild_id).actions)} действий на этом сервере", ephemeral=True
     )
 
-    view = TimerMenu(farm_view=FarmMenu())
 
-    for action_name, timestamp in last_used[user_id].items():
-        cooldown = get_cooldown(action_name)
-        remaining = max(0, int(timestamp + cooldown - time.time()))
-        if remaining > 0:
-            hours, remainder = divmod(remaining, 3600)
-            mins, secs = divmod(remainder, 60)
-            timer_text = f"{hours} ч {mins} мин {secs} сек"
-            embed.add_field(
-                name=f"⏳ {action_name}",
-                value=f"Доступно через: `{timer_text}`",
-                inline=False
-            )
-            view.add_delete_button(action_name)
+STATS_PERIOD_CHOICES = [app_commands.Choice(name=name.capitalize(), value=days) for days, name in STATS_PERIODS.items()]
+
+
+@tree.command(name="статистика", description="Сколько раз вы или другой игрок запускали каждое действие")
+@app_commands.describe(period="За какой срок, по умолчанию неделя", member="Чья статистика, по умолчанию ваша")
+@app_commands.rename(period="период", member="игрок")
+@app_commands.choices(period=STATS_PERIOD_CHOICES)
+async def stats_command(interaction: discord.Interaction, period: app_commands.Choice[int] = None, member: discord.User = None):
+    days = period.value if period else 7
+    member = member or interaction.user
+    rows = activity_stats.player(member.id, days)
+
+    embed = discord.Embed(title=f"📊 {member.display_name} — {STATS_PERIODS[days]}", color=discord.Color.blue())
+    if rows:
+        embed.description = "\n".join(f"**{action_name}** — {count}" for action_name, count in rows[:25])
+        embed.set_footer(text=f"Всего запусков: {sum(count for _, count in rows)}")
+    else:
+        embed.description = "За этот срок запусков нет."
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@tree.command(name="топ", description="Кто на сервере фармил больше всех")
+@app_commands.describe(period="За какой срок, по умолчанию неделя", action="Только это действие")
+@app_commands.rename(period="период", action="действие")
+@app_commands.choices(period=STATS_PERIOD_CHOICES)
+@app_commands.guild_only()
+async def top_command(interaction: discord.Interaction, period: app_commands.Choice[int] = None, action: str = None):
+    days = period.value if period else 7
+    stats = await activity_stats.guild(interaction.guild_id, days)
+
+    if action:
+        players = stats.by_action.get(action, collections.Counter()).most_common(STATS_TOP_SIZE)
+        title = f"🏆 {action} — {STATS_PERIODS[days]}"
+    else:
+        players = stats.players[:STATS_TOP_SIZE]
+        title = f"🏆 Топ фарма — {STATS_PERIODS[days]}"
+
+    embed = discord.Embed(title=title, color=discord.Color.gold())
+    if players:
+        embed.description = "\n".join(
+            f"{place}. <@{user_id}> — {count}" for place, (user_id, count) in enumerate(players, 1)
+        )
+    else:
+        embed.description = "За этот срок запусков нет."
+    if not action and stats.actions:
+        embed.add_field(
+            name="Популярные действия",
+            value="\n".join(f"{action_name} — {count}" for action_name, count in stats.actions[:5]),
+            inline=False
+        )
+    if stats.hours:
+        embed.add_field(
+            name="Пиковые часы",
+            value=", ".join(f"{hour:02d}:00" for hour, _ in stats.hours[:3]),
+            inline=False
+        )
+    embed.set_footer(text=f"Сводка обновляется раз в {STATS_CACHE_TTL // 60} мин")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@top_command.autocomplete("action")
+async def top_action_autocomplete(interaction: discord.Interaction, current: str):
+    names = [*get_catalog(interaction.guild_id).actions, STATS_CUSTOM_ACTION]
+    current = current.lower()
+    return [app_commands.Choice(name=name, value=name) for name in names if current in name.lower()][:25]
+
+
+async def catalog_action_autocomplete(interaction: discord.Interaction, current: str):
+    current = current.lower()
+    return [
+        app_commands.Choice(name=name, value=name)
+        for name in get_catalog(interaction.guild_id).actions if current in name.lower()
+    ][:25]
+
+def routines_text(user_id, changed):
+    # changed ещё в очереди DBWriter — подставляем его поверх прочитанного
+    routines = {routine.action_name: routine for routine in get_routines_from_db(user_id)}
+    routines[changed.action_name] = changed
+
+    lines = []
+    for _, routine in sorted(routines.items()):
+        if not routine.repeat and not routine.next_action:
+            continue
+        parts = ["🔁"] if routine.repeat else []
+        if routine.next_action:
+            parts.append(f"➡️ {routine.next_action}")
+        lines.append(f"**{routine.action_name}** {' '.join(parts)}")
+    return "\n".join(lines) or "Повторов и цепочек нет."
+
+
+@tree.command(name="повтор", description="Сразу перезапускать таймер действия, когда он истёк")
+@app_commands.describe(action="Действие из меню фарма", enabled="Включить или выключить повтор")
+@app_commands.rename(action="действие", enabled="включить")
+async def repeat_command(interaction: discord.Interaction, action: str, enabled: bool = True):
+    user_id = interaction.user.id
+    if action not in get_catalog(interaction.guild_id).actions:
+        await interaction.response.send_message("❌ Такого действия нет в меню фарма.", ephemeral=True)
+        return
+
+    routine = get_routine_from_db(user_id, action)
+    next_action = routine.next_action if routine else None
+    routine = Routine(action, enabled, next_action, interaction.guild_id)
+    save_routine_to_db(user_id, routine)
+    await interaction.response.send_message(routines_text(user_id, routine), ephemeral=True)
+
+
+@tree.command(name="цепочка", description="Когда истечёт одно действие, сразу запускать другое")
+@app_commands.describe(after="Какое действие истекает", then="Что запустить следом; пусто — убрать цепочку")
+@app_commands.rename(after="после", then="затем")
+async def chain_command(interaction: discord.Interaction, after: str, then: str = None):
+    user_id = interaction.user.id
+    actions = get_catalog(interaction.guild_id).actions
+    if after not in actions or (then and then not in actions):
+        await interaction.response.send_message("❌ Такого действия нет в меню фарма.", ephemeral=True)
+        return
+
+    routine = get_routine_from_db(user_id, after)
+    repeat = routine.repeat if routine else False
+    routine = Routine(after, repeat, then or None, interaction.guild_id)
+    save_routine_to_db(user_id, routine)
+    await interaction.response.send_message(routines_text(user_id, routine), ephemeral=True)
+
+
+repeat_command.autocomplete("action")(catalog_action_autocomplete)
+chain_command.autocomplete("after")(catalog_action_autocomplete)
+chain_command.autocomplete("then")(catalog_action_autocomplete)
+
+
+@tree.command(name="уведомления", description="Как и когда присылать напоминания в ЛС")
+@app_commands.describe(
+    mode="Сразу, дайджестом или только последнее истёкшее",
+    minutes="Как часто присылать дайджест, минут",
+    quiet_from="Начало тихих часов (час 0–23)",
+    quiet_to="Конец тихих часов; равен началу — без тихих часов",
+    utc_offset="Ваш часовой пояс относительно UTC, по умолчанию МСК (+3)"
+)
+@app_commands.rename(mode="режим", minutes="минуты", quiet_from="тихо_с", quiet_to="тихо_до", utc_offset="пояс")
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Сразу", value=DELIVERY_NOW),
+    app_commands.Choice(name="Дайджест раз в N минут", value=DELIVERY_DIGEST),
+    app_commands.Choice(name="Только последнее", value=DELIVERY_LATEST)
+])
+async def delivery_command(
+    interaction: discord.Interaction,
+    mode: app_commands.Choice[str] = None,
+    minutes: app_commands.Range[int, 5, 720] = None,
+    quiet_from: app_commands.Range[int, 0, 23] = None,
+    quiet_to: app_commands.Range[int, 0, 23] = None,
+    utc_offset: app_commands.Range[int, -12, 14] = None
+):
+    if (quiet_from is None) != (quiet_to is None):
+        await interaction.response.send_message("❌ Укажите и начало, и конец тихих часов.", ephemeral=True)
+        return
+
+    # Не указанное остаётся как было
+    prefs = get_delivery_from_db(interaction.user.id)
+    if mode is not None:
+        prefs = prefs._replace(mode=mode.value)
+    if minutes is not None:
+        prefs = prefs._replace(digest_minutes=minutes)
+    if quiet_from is not None:
+        prefs = prefs._replace(quiet_start=quiet_from, quiet_end=quiet_to)
+    if utc_offset is not None:
+        prefs = prefs._replace(utc_offset=utc_offset)
 
-    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+    save_delivery_to_db(interaction.user.id, prefs)
+    await interaction.response.send_message(delivery_text(prefs), ephemeral=True)
 
 
 # --- Уведомления по истечении ---
+started = False
+
+
 @bot.event
 async def on_ready():
+    # on_ready приходит и после каждого переподключения к шлюзу
+    global started
     print(f'Бот {bot.user} запущен!')
-    await tree.sync()
+    if started:
+        return
+    started = True
+
     init_db()
-    load_data_from_db()
+    load_settings_from_db()
+    if not (SNAPSHOT_RESTORE and restore_snapshot_on_start(SNAPSHOT_RESTORE)):
+        asyncio.create_task(load_data_from_db())
+    dm_pipeline.start()
     asyncio.create_task(check_notifications())
+    if MULTI_PROCESS:
+        asyncio.create_task(sweep_orphaned_notifications())
+    asyncio.create_task(timer_compactor.run())
+    asyncio.create_task(event_log.run())
+    if metrics.enabled:
+        await start_metrics()
+
+    tree_hash = command_tree_hash()
+    if get_state_from_db("command_tree_hash") != tree_hash:
+        await tree.sync()
+        save_state_to_db("command_tree_hash", tree_hash)
+
+
+def load_due_settings(due, now):
+    # Всё, что нужно пачке сработавших уведомлений, — несколькими запросами
+    # на пачку; вызывается в потоке, чтобы не держать цикл событий
+    prefs = get_deliveries_from_db([notify["user_id"] for notify in due])
+    routines = get_due_routines_from_db([(notify["user_id"], notify["action_name"]) for notify in due])
+    # Таймер следующего действия мог запустить другой процесс — перед цепочкой
+    # сверяемся с БД, а не только с локальным TimerStore
+    chained = [user_id for (user_id, _), routine in routines.items() if routine.next_action] if MULTI_PROCESS else []
+    return prefs, routines, get_users_timers_from_db(chained, now)
+
+def rearm_routines(due, now, prefs, routines, timers):
+    # Повтор и цепочка заводятся прямо при срабатывании: таймер перезапускается,
+    # строка notifications получает новый end_time вместо новой записи, игроку
+    # не нужно заходить в меню. Занятое следующее действие цепочка не трогает
+    for user_id, rows in timers.items():
+        refresh_user_timers(user_id, rows)
+
+    records = []
+    for notify in due:
+        user_id = notify["user_id"]
+        routine = routines.get((user_id, notify["action_name"]))
+        if routine is None:
+            continue
+        notify["routine"] = True
+        # Игрок спит — цикл не гоняем вхолостую, но и не бросаем: таймеры
+        # стартуют с концом тихих часов, туда же планировщик доставки перенесёт ЛС
+        started_at = now
+        if in_quiet_hours(prefs[user_id], now):
+            started_at = quiet_hours_end(prefs[user_id], now)
+
+        catalog = get_catalog(routine.guild_id)
+        notes = []
+        action = catalog.actions.get(routine.action_name)
+        if routine.repeat and action is not None:
+            records.append((timer_store.start(user_id, action.name, started_at, action.cooldown), routine.guild_id))
+            notes.append("🔁 запущено снова")
+        action = catalog.actions.get(routine.next_action)
+        if action is not None and action.name != routine.action_name and is_action_available(user_id, action.name):
+            records.append((timer_store.start(user_id, action.name, started_at, action.cooldown), routine.guild_id))
+            notes.append(f"➡️ запущено «{action.name}»")
+        if notes and started_at > now:
+            notes.append("🌙 отсчёт пошёл с концом тихих часов")
+        notify["note"] = ", ".join(notes)
+
+    if records:
+        save_timers_to_db(records)
+        notification_scheduler.add_many([
+            (record.user_id, record.action_name, record.end_time, guild_id) for record, guild_id in records
+        ])
+
+
+async def dispatch_due(due, now):
+    if not due:
+        return
+    prefs, routines, timers = await asyncio.to_thread(load_due_settings, due, now)
+    rearm_routines(due, now, prefs, routines, timers)
+    for notify in due:
+        await dm_pipeline.submit(notify, prefs[notify["user_id"]])
 
 
 async def check_notifications():
     while True:
-        current_time = time.time()
-        to_remove = []
-
-        for notify in pending_notifications:
-            if notify["end_time"] <= current_time:
-                user_id = notify["user_id"]
-                action_name = notify["action_name"]
+        await notification_scheduler.wait()
 
+        started = time.perf_counter()
+        now = time.time()
+        due = notification_scheduler.pop_due(now, limit=NOTIFY_BURST)
+        if MULTI_PROCESS and due:
+            try:
+                due = await asyncio.to_thread(claim_notifications_in_db, due, now)
+            except sqlite3.Error as e:
+                # Строки остались без аренды — их подберёт sweep_orphaned_notifications
+                print(f"[Ошибка] Не удалось захватить уведомления: {e}")
+                due = []
+        await dispatch_due(due, now)
+        if metrics.enabled:
+            metrics.observe("farm_bot_handler_seconds", time.perf_counter() - started, handler="check_notifications")
+            metrics.inc("farm_bot_notifications_due_total", len(due))
+
+        # Если после простоя накопилось много просроченных — догоняем пачками
+        if len(due) >= NOTIFY_BURST:
+            await asyncio.sleep(NOTIFY_BURST_DELAY)
+
+
+async def sweep_orphaned_notifications():
+    while True:
+        await asyncio.sleep(NOTIFY_ORPHAN_SWEEP)
+        try:
+            orphans = await asyncio.to_thread(claim_orphaned_notifications_in_db, time.time())
+        except sqlite3.Error as e:
+            print(f"[Ошибка] Не удалось забрать брошенные уведомления: {e}")
+            continue
+        await dispatch_due(orphans, time.time())
+
+
+def notification_text(action_name, guild_id=None):
+    action = get_catalog(guild_id).actions.get(action_name)
+    if action is not None:
+        return action.notify_message
+    return f"🔔 Задание \"{action_name}\" снова доступно!"
+
+
+# --- Доставка уведомлений в ЛС ---
+DM_WORKERS = 8
+DM_QUEUE_SIZE = 1000
+DM_MERGE_WINDOW = 1.0  # сколько секунд ждём другие таймеры того же игрока
+DM_CHANNEL_CACHE_SIZE = 5000
+DM_ROUTE_RATE = 1  # сообщений в секунду в один ЛС-канал
+DM_ROUTE_BURST = 5
+DM_GLOBAL_RATE = 40  # сообщений в секунду на весь бот
+DM_RETRIES = 3
+DM_RETRY_BASE_DELAY = 1.0
+DM_DIGEST_LINES = 20  # строк таймеров в одном сообщении, остальное — счётчиком
+
+
+class DMPipeline:
+    # Истёкшие таймеры игрока копятся в одну пачку, а когда её отправить,
+    # решают его настройки: сразу (с окном склейки DM_MERGE_WINDOW), дайджестом,
+    # после тихих часов. Планировщик отдаёт воркерам только созревшие пачки,
+    # так что отложенные игроки не занимают воркеров и не держат очередь.
+    def __init__(self):
+        self._queue = asyncio.Queue(maxsize=DM_QUEUE_SIZE)  # user_id созревших пачек
+        self._pending = {}  # user_id -> [notify]
+        self._plans = {}  # user_id -> (send_at, DeliveryPrefs)
+        self._plan = []  # куча (send_at, user_id)
+        self._wakeup = asyncio.Event()
+        self._channels = collections.OrderedDict()  # user_id -> DMChannel, LRU
+        self._routes = RateLimiter(DM_ROUTE_RATE, DM_ROUTE_BURST, DM_CHANNEL_CACHE_SIZE)  # channel_id -> TokenBucket
+        self._global = TokenBucket(DM_GLOBAL_RATE, DM_GLOBAL_RATE)
+        self._workers = []
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency = collections.deque(maxlen=10000)  # секунды от end_time до отправки
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(DM_WORKERS)]
+        self._workers.append(asyncio.create_task(self._run_planner()))
+
+    def planned(self):
+        return len(self._plans)
+
+    async def submit(self, notify, prefs):
+        user_id = notify["user_id"]
+        now = time.time()
+        batch = self._pending.get(user_id)
+        if batch is None:
+            send_at = delivery_time(prefs, now)
+            batch = self._pending[user_id] = []
+            self._plans[user_id] = (send_at, prefs)
+            if not self._plan or send_at < self._plan[0][0]:
+                self._wakeup.set()
+            heapq.heappush(self._plan, (send_at, user_id))
+
+        batch.append(notify)
+        send_at = self._plans[user_id][0]
+        if MULTI_PROCESS and send_at > now + NOTIFY_LEASE / 2:
+            extend_notification_leases_in_db([notify], send_at + NOTIFY_LEASE)
+
+    async def _run_planner(self):
+        while True:
+            if not self._plan:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            send_at, user_id = self._plan[0]
+            delay = send_at - time.time()
+            if delay > 0:
+                self._wakeup.clear()
                 try:
-                    user = await bot.fetch_user(user_id)
-                    msg_text = {
-                        "Оплата на 29 дней": "🔔 Ваша оплата имущества на 29 дней завершена. Пора продлить!",
-                        "Оплата на 6 дней": "🔔 Ваша оплата имущества на 6 дней завершена. Пора продлить!"
-                    }.get(action_name, f"🔔 Задание \"{action_name}\" снова доступно!")
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._plan)
+            await self._queue.put(user_id)
 
-                    view = NotificationView(user_id, action_name)
-                    message = await user.send(msg_text, view=view)
-                    notify["message"] = message
+    def latency_percentile(self, p):
+        samples = sorted(self.latency)
+        if not samples:
+            return 0
+        return samples[min(len(samples) - 1, len(samples) * p // 100)]
 
-                except Exception as e:
+    async def _worker(self):
+        while True:
+            user_id = await self._queue.get()
+            try:
+                batch = self._pending.pop(user_id)
+                _, prefs = self._plans.pop(user_id)
+                await self._deliver(user_id, batch, prefs)
+                delete_fired_notifications_from_db(batch)
+            except Exception as e:
+                print(f"[Ошибка] Сбой воркера уведомлений: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, user_id, batch, prefs):
+        # Одно действие могло истечь в пачке дважды (повтор, откат) — в ЛС только
+        # последнее: одинаковые custom_id кнопок Discord отвергает целиком
+        latest = {notify["action_name"]: notify for notify in sorted(batch, key=lambda notify: notify["end_time"])}
+        shown = sorted(latest.values(), key=lambda notify: notify["end_time"])
+        if prefs.mode == DELIVERY_LATEST:
+            shown = shown[-1:]
+        shown = shown[:DM_DIGEST_LINES]
+
+        lines = [
+            notification_text(notify["action_name"], notify.get("guild_id")) + (f" ({notify['note']})" if notify.get("note") else "")
+            for notify in shown
+        ]
+        if len(latest) > len(shown):
+            lines.append(f"…и ещё истёкших таймеров: {len(latest) - len(shown)}")
+        msg_text = "\n".join(lines)
+        view = notification_layout(tuple((notify["action_name"], notify.get("routine", False)) for notify in shown))
+
+        for attempt in range(DM_RETRIES + 1):
+            try:
+                channel = await self._get_channel(user_id)
+                await self._routes.bucket(channel.id).take()
+                await self._global.take()
+                message = await channel.send(msg_text, view=view)
+                break
+            except (discord.Forbidden, discord.NotFound) as e:
+                self.failed += 1
+                print(f"[Ошибка] Не удалось отправить уведомление: {e}")
+                return
+            except (discord.HTTPException, OSError, asyncio.TimeoutError) as e:
+                transient = not isinstance(e, discord.HTTPException) or e.status == 429 or e.status >= 500
+                if not transient or attempt == DM_RETRIES:
+                    self.failed += 1
                     print(f"[Ошибка] Не удалось отправить уведомление: {e}")
+                    return
+                self.retries += 1
+                await asyncio.sleep(DM_RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, 1))
+
+        now = time.time()
+        for notify in batch:
+            notify["message"] = message
+            self.latency.append(now - notify["end_time"])
+        self.sent += 1
+
+    async def _get_channel(self, user_id):
+        channel = self._channels.get(user_id)
+        if channel is not None:
+            self._channels.move_to_end(user_id)
+            return channel
 
-                to_remove.append(notify)
+        # Сначала кэш клиента, в REST идём только если пользователя там нет
+        user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+        channel = user.dm_channel or await user.create_dm()
 
-        for item in to_remove:
-            pending_notifications.remove(item)
+        self._channels[user_id] = channel
+        if len(self._channels) > DM_CHANNEL_CACHE_SIZE:
+            self._channels.popitem(last=False)
+        return channel
 
-        await asyncio.sleep(60)
+
+dm_pipeline = DMPipeline()
 
 
 # --- Вспомогательные функции ---
 def is_action_available(user_id, action_name):
-    current_time = time.time()
-    cooldown = get_cooldown(action_name)
-    if user_id in last_used and action_name in last_used[user_id]:
-        elapsed = current_time - last_used[user_id][action_name]
-        return elapsed >= cooldown
-    return True
+    record = timer_store.get(user_id, action_name)
+    return record is None or record.end_time <= time.time()
 
 def get_remaining_time(user_id, action_name):
-    current_time = time.time()
-    cooldown = get_cooldown(action_name)
-    if user_id in last_used and action_name in last_used[user_id]:
-        return max(0, int(cooldown - (current_time - last_used[user_id][action_name])))
-    return 0
-
-def get_cooldown(action_name):
-    return custom_cooldowns.get(action_name, COOLDOWN_DEFAULT)
+    record = timer_store.get(user_id, action_name)
+    if record is None:
+        return 0
+    return max(0, int(record.end_time - time.time()))
 
 
 # --- Приветствие новых участников ---
-class StartMenu(ui.View):
-    def __init__(self, farm_view):
+class StartMenu(BotView):
+    def __init__(self, catalog):
         super().__init__(timeout=None)
-        self.farm_view = farm_view
+        self.bind_catalog(catalog)
 
-    @ui.button(label="Открыть Фарм", style=ButtonStyle.green)
+    @ui.button(label="Открыть Фарм", style=ButtonStyle.green, custom_id="start:open_farm")
     async def open_farm(self, interaction: discord.Interaction, button: ui.Button):
         embed = discord.Embed(
             title="🌾 Фарм GTA V RP",
             description="Выберите тип фарма:",
             color=discord.Color.green()
         )
-        view = self.farm_view
+        view = self.catalog.view("farm")
         await interaction.response.edit_message(embed=embed, view=view)
 
 
+# --- Постоянные меню ---
+MENU_VIEWS = {"farm": FarmMenu, "club": ClubTaskMenu, "payment": PaymentMenu, "timers": TimerMenu, "start": StartMenu}
+
+
+def register_views():
+    # По одному обработчику на меню каждого каталога. Повторный вызов после
+    # перезагрузки каталога перезаписывает те же custom_id, хранилище не растёт
+    for catalog in catalogs.values():
+        for view_class in MENU_VIEWS.values():
+            bot.add_view(view_class(catalog))
+    bot.add_view(NotificationView())
+    bot.add_dynamic_items(DeleteTimerButton, NotificationTimerButton)
+
+
+async def shutdown():
+    # Client.run ловит только KeyboardInterrupt, а хостинг перезапускает бота
+    # через SIGTERM — без обработчика процесс умирает мимо atexit, и очередь
+    # записи с буфером журнала теряются
+    await bot.close()
+    event_log.flush()
+    db_writer.close()
+
+
+@bot.event
+async def setup_hook():
+    register_views()
+    with contextlib.suppress(NotImplementedError):  # на Windows сигналов в цикле событий нет
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(shutdown()))
+
+
 @bot.event
 async def on_member_join(member: discord.Member):
     try:
@@ -674,7 +3827,7 @@ async def on_member_join(member: discord.Member):
             description="Этот бот поможет вам следить за таймерами.\n\n🔹 Нажмите кнопку ниже, чтобы начать!\n🔹 Бот работает с FiveM / RAGE.MP серверами",
             color=discord.Color.green()
         )
-        view = StartMenu(farm_view=FarmMenu())
+        view = get_catalog(member.guild.id).view("start")
         await member.send(embed=embed_dm, view=view)
     except discord.Forbidden:
         print(f"[Ошибка] Не могу отправить ЛС пользователю {member.name} — закрытые сообщения отключены.")
@@ -687,19 +3840,42 @@ async def on_message(message: discord.Message):
         return
 
     if message.content.lower() in ["меню", "!фарм"]:
+        if not allow_request(message.author.id, message.channel.id):
+            return
         embed = discord.Embed(
             title="🌾 Фарм GTA V RP",
             description="Выберите тип фарма:",
             color=discord.Color.green()
         )
-        view = FarmMenu()
+        view = get_catalog(message.guild.id if message.guild else None).view("farm")
         await message.channel.send(embed=embed, view=view)
 
 
 # --- Запуск бота ---
 if __name__ == "__main__":
-    # Для локального запуска
-    bot.run("Твой_токен")
+    if "--backfill-stats" in sys.argv:
+        # python bot.py --backfill-stats — пересобрать сводки статистики по журналу
+        init_db()
+        print(f"Сводки пересобраны, событий: {activity_stats.backfill()}")
+        db_writer.flush()
+    elif "--snapshot" in sys.argv:
+        # python bot.py --snapshot — снимок рядом с работающим ботом или без него
+        init_db()
+        print(make_snapshot())
+    elif "--restore" in sys.argv:
+        # python bot.py --restore snapshots/farm_bot-….snap|.delta|.db — только при остановленном боте
+        path = sys.argv[sys.argv.index("--restore") + 1]
+        if path.endswith(".db"):
+            with contextlib.closing(sqlite3.connect(path)) as source, contextlib.closing(connect_db()) as target:
+                source.backup(target)
+        else:
+            init_db()
+            restore_snapshot_to_db(*read_snapshot_with_base(path))
+            db_writer.flush()
+        print(f"База восстановлена из {path}")
+    else:
+        # Для локального запуска
+        bot.run("Твой_токен")
 else:
     # Для Replit / Railway
     import os
@@ -0,0 +1,606 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import discord
+
+# Нагрузочный прогон бота без Discord: настоящие обработчики bot.py, а вместо
+# шлюза и REST — заглушки с задержкой и лимитами. Пример:
+#   python loadtest.py --users 2000 --clicks 5 --expiring 20000 --latency 0.05
+#   python loadtest.py --memory --memory-timers 1000000  # заодно проверяет потолок памяти таймеров
+
+# bot.py при импорте сразу вызывает bot.run — шлюза здесь нет
+discord.Client.run = lambda self, *args, **kwargs: None
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+REST_GLOBAL_RATE = 50  # запросов в секунду на весь бот, как у Discord
+REST_ROUTE_RATE = 5  # запросов в секунду в один канал или вебхук взаимодействия
+REST_ROUTE_BURST = 5
+REST_GLOBAL_EXEMPT = ("interaction_response", "edit_original_response", "delete_original_response")
+TIMER_BYTES_BOUND = 120  # потолок памяти TimerStore на таймер для --memory
+
+
+class FakeDiscord:
+    # REST-заглушка: считает вызовы, держит лимиты как Discord и отвечает с задержкой.
+    # При пустом ведре запрос не падает, а ждёт — как discord.py после 429.
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.rate_limited = collections.Counter()
+        self._global = None
+        self._routes = {}
+        self._ids = itertools.count(10 ** 17)
+        self.users = {}
+
+    def next_id(self):
+        return next(self._ids)
+
+    async def request(self, route, bucket):
+        if self._global is None:
+            self._global = bot_module.TokenBucket(REST_GLOBAL_RATE, REST_GLOBAL_RATE)
+        limiter = self._routes.get(bucket)
+        if limiter is None:
+            limiter = self._routes[bucket] = bot_module.TokenBucket(REST_ROUTE_RATE, REST_ROUTE_BURST)
+
+        self.calls[route] += 1
+        # Ответы на взаимодействия в глобальный лимит Discord не входят
+        limiters = (limiter,) if route in REST_GLOBAL_EXEMPT else (limiter, self._global)
+        for bucket_limiter in limiters:
+            if not bucket_limiter.try_take():
+                self.rate_limited[route] += 1
+                await bucket_limiter.take()
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+    def get_user(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = FakeUser(self, user_id)
+        return user
+
+
+class FakeUser:
+    def __init__(self, fake, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.dm_channel = None
+        self._fake = fake
+
+    async def create_dm(self):
+        await self._fake.request("create_dm", f"dm:{self.id}")
+        self.dm_channel = FakeChannel(self._fake)
+        return self.dm_channel
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeChannel:
+    def __init__(self, fake):
+        self.id = fake.next_id()
+        self._fake = fake
+
+    async def send(self, content=None, view=None, **kwargs):
+        await self._fake.request("channel_message", f"channel:{self.id}")
+        # Discord отвечает 400 на сообщение с повторяющимися custom_id
+        custom_ids = [item.custom_id for item in view.walk_children() if getattr(item, "custom_id", None)] if view else []
+        if len(custom_ids) != len(set(custom_ids)):
+            raise discord.HTTPException(types.SimpleNamespace(status=400, reason="Bad Request"), "duplicate custom_id")
+        return FakeMessage(self._fake, self, content=content)
+
+
+class FakeMessage:
+    def __init__(self, fake, channel, author=None, content=None, guild=None):
+        self.id = fake.next_id()
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.guild = guild
+        self._fake = fake
+
+    async def delete(self):
+        await self._fake.request("delete_message", f"channel:{self.channel.id}")
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+        self.modal = None
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self, route):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        await self._interaction.fake.request(route, f"interaction:{self._interaction.id}")
+        self._interaction.responded()
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond("interaction_response")
+
+    async def edit_message(self, **kwargs):
+        await self._respond("interaction_response")
+
+    async def send_modal(self, modal):
+        self.modal = modal
+        await self._respond("interaction_response")
+
+    async def defer(self, **kwargs):
+        await self._respond("interaction_response")
+
+
+class FakeInteraction:
+    def __init__(self, fake, user, guild, on_response):
+        self.fake = fake
+        self.id = fake.next_id()
+        self.type = discord.InteractionType.component
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id if guild else None
+        self.client = bot_module.bot
+        self.message = FakeMessage(fake, FakeChannel(fake), guild=guild)
+        self.response = FakeResponse(self)
+        self.created = time.perf_counter()
+        self.edits = 0
+        self._on_response = on_response
+
+    def responded(self):
+        self._on_response(time.perf_counter() - self.created)
+
+    async def edit_original_response(self, **kwargs):
+        await self.fake.request("edit_original_response", f"webhook:{self.id}")
+        self.edits += 1
+
+    async def delete_original_response(self):
+        await self.fake.request("delete_original_response", f"webhook:{self.id}")
+
+
+class Scenario:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.operations = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.shed = None
+        self.edits = None
+
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        samples = sorted(self.latencies)
+        return samples[min(len(samples) - 1, len(samples) * p // 100)]
+
+    def report(self):
+        rate = self.operations / self.elapsed if self.elapsed else 0
+        return (
+            f"{self.name:<14} {self.operations:>8} оп  {self.elapsed:>7.2f} с  {rate:>9.0f} оп/с  "
+            f"p50 {self.percentile(50) * 1000:>7.2f} мс  p99 {self.percentile(99) * 1000:>7.2f} мс  "
+            f"ошибок {self.errors}"
+        ) + ("" if self.shed is None else f"  отклонено {self.shed}") + (
+            "" if self.edits is None else f"  правок {self.edits}"
+        )
+
+
+async def run_concurrently(jobs, concurrency, scenario):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            try:
+                await job()
+                scenario.operations += 1
+            except Exception as e:
+                scenario.errors += 1
+                if scenario.errors == 1:
+                    print(f"[{scenario.name}] первая ошибка: {e!r}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(job) for job in jobs))
+    scenario.elapsed = time.perf_counter() - started
+
+
+def find_item(view, suffix):
+    for item in view.children:
+        if getattr(item, "custom_id", "").endswith(suffix):
+            return item
+    raise LookupError(suffix)
+
+async def click(view, suffix, interaction):
+    # То же, что делает discord.py при нажатии: проверка, затем колбэк кнопки
+    item = find_item(view, suffix)
+    if await view.interaction_check(interaction):
+        await item.callback(interaction)
+
+
+async def scenario_clicks(fake, args, guild, menus):
+    # Игроки жмут случайные действия; повторные нажатия попадают в обратный отсчёт
+    scenario = Scenario("клики")
+    actions = [(menu, action) for menu in ("farm", "club", "payment") for action in menus.catalog.menus[menu]]
+
+    def job(user_id, menu, action):
+        async def run():
+            interaction = FakeInteraction(fake, fake.get_user(user_id), guild, scenario.record)
+            await click(menus.views[menu], f"action:{action.name}", interaction)
+        return run
+
+    jobs = [
+        job(user_id, *random.choice(actions))
+        for user_id in range(1, args.users + 1)
+        for _ in range(args.clicks)
+    ]
+    random.shuffle(jobs)
+    await run_concurrently(jobs, args.concurrency, scenario)
+    return scenario
+
+async def scenario_bulk(fake, args, guild, menus):
+    # Несколько действий одним выбором в списке «Запустить несколько»
+    scenario = Scenario("пачка")
+    names = list(menus.catalog.actions)
+
+    def job(user_id):
+        async def run():
+            interaction = FakeInteraction(fake, fake.get_user(user_id), guild, scenario.record)
+            interaction.data = {"values": random.sample(names, min(args.clicks, len(names)))}
+            await click(menus.views["farm"], "farm:bulk_start", interaction)
+        return run
+
+    users = range(args.users + 1, 2 * args.users + 1)  # свои игроки, чтобы не упираться в кулдауны кликов
+    await run_concurrently([job(user_id) for user_id in users], args.concurrency, scenario)
+    return scenario
+
+async def scenario_timers(fake, args, guild, menus):
+    # Открыть список таймеров и снять первый
+    scenario = Scenario("список+❌")
+
+    def job(user_id):
+        async def run():
+            user = fake.get_user(user_id)
+            await click(menus.views["farm"], "farm:timers", FakeInteraction(fake, user, guild, scenario.record))
+
+            active = bot_module.timer_store.active_timers(user_id, time.time())
+            if active:
+                button = bot_module.DeleteTimerButton(menus.catalog, active[0][0])
+                interaction = FakeInteraction(fake, user, guild, scenario.record)
+                if await button.interaction_check(interaction):
+                    await button.callback(interaction)
+        return run
+
+    await run_concurrently([job(user_id) for user_id in range(1, args.users + 1)], args.concurrency, scenario)
+    return scenario
+
+async def scenario_custom(fake, args, guild, menus):
+    scenario = Scenario("кастомный")
+
+    def job(user_id):
+        async def run():
+            user = fake.get_user(user_id)
+            interaction = FakeInteraction(fake, user, guild, scenario.record)
+            await click(menus.views["farm"], "farm:custom_timer", interaction)
+
+            modal = interaction.response.modal
+            # Значения полей discord.py берёт из payload отправки формы
+            modal.days._value, modal.hours._value, modal.minutes._value = "0", str(random.randint(0, 5)), "30"
+            interaction = FakeInteraction(fake, user, guild, scenario.record)
+            if await modal.interaction_check(interaction):
+                await modal.on_submit(interaction)
+        return run
+
+    await run_concurrently([job(user_id) for user_id in range(1, args.users + 1)], args.concurrency, scenario)
+    return scenario
+
+async def scenario_messages(fake, args, guild, menus):
+    scenario = Scenario("меню")
+
+    def job(user_id):
+        async def run():
+            channel = FakeChannel(fake)
+            message = FakeMessage(fake, channel, author=fake.get_user(user_id), content="меню", guild=guild)
+            started = time.perf_counter()
+            await bot_module.on_message(message)
+            scenario.record(time.perf_counter() - started)
+        return run
+
+    await run_concurrently([job(user_id) for user_id in range(1, args.users + 1)], args.concurrency, scenario)
+    return scenario
+
+async def scenario_expiry(fake, args):
+    # M напоминаний с одним сроком: сколько займёт доставка всех ЛС
+    scenario = Scenario("истечение")
+    catalog = bot_module.get_catalog()
+    names = list(catalog.actions)
+    now = time.time()
+    users = set()
+    for i in range(args.expiring):
+        user_id = 1 + i % args.users
+        users.add(user_id)
+        bot_module.notification_scheduler.add(user_id, names[i // args.users % len(names)], now)
+    bot_module.db_writer.flush()
+
+    sent_before = bot_module.dm_pipeline.sent
+    started = time.perf_counter()
+    task = asyncio.create_task(bot_module.check_notifications())
+    pipeline = bot_module.dm_pipeline
+    # Доставленные напоминания воркер удаляет из таблицы — ждём, пока не останется просроченных
+    while True:
+        await asyncio.sleep(0.1)
+        bot_module.db_writer.flush()
+        with bot_module.read_pool.connection() as db:
+            (left,) = db.execute("SELECT COUNT(*) FROM notifications WHERE end_time <= ?", (now,)).fetchone()
+        if not left and not pipeline._pending:
+            break
+    scenario.elapsed = time.perf_counter() - started
+    task.cancel()
+
+    scenario.operations = pipeline.sent - sent_before
+    scenario.errors = pipeline.failed
+    scenario.latencies = list(pipeline.latency)
+    return scenario
+
+
+async def scenario_flood(fake, args, guild, menus):
+    # Спамеры без пауз жмут «Посмотреть таймеры» и пишут «меню» в один канал — с лимитами
+    scenario = Scenario("флуд")
+    channel = FakeChannel(fake)
+
+    def job(user_id, text):
+        async def run():
+            user = fake.get_user(user_id)
+            if text:
+                message = FakeMessage(fake, channel, author=user, content="меню", guild=guild)
+                await bot_module.on_message(message)
+            else:
+                await click(menus.views["farm"], "farm:timers", FakeInteraction(fake, user, guild, scenario.record))
+        return run
+
+    def rejected():
+        return bot_module.user_limiter.rejected + bot_module.channel_limiter.rejected + bot_module.global_rejected
+
+    jobs = [job(user_id, i % 5 == 0) for user_id in range(1, args.spammers + 1) for i in range(args.flood)]
+    rejected_before = rejected()
+    await run_concurrently(jobs, args.concurrency, scenario)
+    scenario.shed = rejected() - rejected_before
+    return scenario
+
+
+async def scenario_countdowns(fake, args, menus, mode):
+    # Зрители держат открытым отсчёт одного действия или список таймеров, пока
+    # таймеры не истекут: сколько правок сообщений это стоит в каждом режиме.
+    # Живым у игрока остаётся только последнее сообщение, поэтому половина
+    # зрителей смотрит отсчёт, половина — список. Свой сервер на режим,
+    # игроки — вне диапазона остальных сценариев
+    scenario = Scenario(f"отсчёты {mode}")
+    guild = FakeGuild(2 if mode == bot_module.TIMER_MODE_LIVE else 3)
+    bot_module.guild_timer_modes[guild.id] = mode
+    names = list(menus.catalog.actions)[:3]
+    users = range(10 ** 6 * guild.id, 10 ** 6 * guild.id + args.viewers)
+    interactions = []
+
+    def job(user_id):
+        async def run():
+            user = fake.get_user(user_id)
+            for action_name in names:
+                duration = random.uniform(args.countdown_seconds / 2, args.countdown_seconds)
+                bot_module.timer_store.start(user_id, action_name, time.time(), duration)
+
+            interaction = FakeInteraction(fake, user, guild, scenario.record)
+            interactions.append(interaction)
+            if user_id % 2:
+                await menus.views["farm"].show_countdown(interaction, names[0])
+                return
+
+            # ❌ у одного таймера: список оставшихся дальше обновляет тикер
+            button = bot_module.DeleteTimerButton(menus.catalog, names[-1])
+            if await button.interaction_check(interaction):
+                await button.callback(interaction)
+        return run
+
+    ticker = bot_module.countdown_ticker
+    deferred = ticker.deferred
+    await run_concurrently([job(user_id) for user_id in users], args.concurrency, scenario)
+    # Последняя правка каждого сообщения — «доступно» по истечении таймеров
+    started = time.perf_counter()
+    while any(user_id in ticker._by_user for user_id in users):
+        await asyncio.sleep(0.1)
+    scenario.elapsed += time.perf_counter() - started
+
+    scenario.edits = sum(interaction.edits for interaction in interactions)
+    print(
+        f"[{scenario.name}] {args.viewers} зрителей, таймеры до {args.countdown_seconds:.0f} с: "
+        f"{scenario.edits / args.viewers:.1f} правок на зрителя, ожиданий бюджета правок {ticker.deferred - deferred}"
+    )
+    return scenario
+
+
+def check_timer_memory(args):
+    # Память таймеров: прежний словарь словарей против TimerStore на тех же данных.
+    # Треть таймеров — кастомные, у каждого своё название. Падает, если хранилище
+    # вылезло за TIMER_BYTES_BOUND байт на таймер
+    catalog_names = list(bot_module.get_catalog().actions)
+    users = max(1, args.memory_timers // 5)
+    now = time.time()
+
+    def timers():
+        for i in range(args.memory_timers):
+            if i % 3:
+                action_name = catalog_names[i % len(catalog_names)]
+            else:
+                action_name = bot_module.custom_timer_name(i % 4, i % 24, i % 60)
+            # Из БД каждое название приходит отдельным объектом строки
+            yield i % users, action_name.encode().decode(), now + i % 7200
+
+    before = tracemalloc.get_traced_memory()[0]
+    last_used = {}
+    for user_id, action_name, end_time in timers():
+        last_used.setdefault(user_id, {})[action_name] = end_time
+    count = sum(len(actions) for actions in last_used.values())
+    dict_bytes = (tracemalloc.get_traced_memory()[0] - before) / count
+    del last_used
+
+    before = tracemalloc.get_traced_memory()[0]
+    store = bot_module.TimerStore(catalog_names)
+    for user_id, action_name, end_time in timers():
+        store.start(user_id, action_name, now, end_time - now)
+    store_bytes = (tracemalloc.get_traced_memory()[0] - before) / len(store)
+
+    print(
+        f"Память таймеров ({len(store)} шт.): словарь словарей {dict_bytes:.0f} Б/таймер, "
+        f"TimerStore {store_bytes:.0f} Б/таймер, потолок {TIMER_BYTES_BOUND}"
+    )
+    assert store_bytes <= TIMER_BYTES_BOUND, f"TimerStore: {store_bytes:.0f} Б на таймер"
+    assert store_bytes < dict_bytes, "TimerStore не экономнее словаря"
+
+
+async def check_countdown_ticker(fake, guild, menus):
+    # Одиночный отсчёт должен перерисовываться до самого конца: после первой
+    # правки куча тикера пустеет, и цикл не имеет права на этом завершиться
+    ticker = bot_module.countdown_ticker
+    user = fake.get_user(0)
+    action_name = next(iter(menus.catalog.actions))
+    bot_module.timer_store.start(user.id, action_name, time.time(), 2.0)
+
+    countdown_interval = bot_module.countdown_interval
+    bot_module.countdown_interval = lambda remaining: 0.3
+    try:
+        interaction = FakeInteraction(fake, user, guild, lambda latency: None)
+        edits_before = ticker.edits
+        await menus.views["farm"].show_countdown(interaction, action_name)
+        await asyncio.sleep(2.5)
+    finally:
+        bot_module.countdown_interval = countdown_interval
+
+    edits = ticker.edits - edits_before
+    print(f"Одиночный отсчёт на 2 с с шагом 0.3 с: {edits} правок")
+    assert edits >= 3, f"одиночный отсчёт отредактирован {edits} раз"
+    assert not ticker._by_user.get(user.id), "отсчёт не снят после последней правки"
+    bot_module.timer_store.remove(user.id, action_name)
+
+
+async def check_digest_duplicates(fake):
+    # Сводка, где одно действие истекло дважды, должна уйти одним сообщением
+    pipeline = bot_module.dm_pipeline
+    action_name = next(iter(bot_module.get_catalog().actions))
+    now = time.time()
+    batch = [
+        bot_module.new_notify(0, action_name, now - 60),
+        bot_module.new_notify(0, action_name, now),
+    ]
+    sent, failed = pipeline.sent, pipeline.failed
+    await pipeline._deliver(0, batch, bot_module.DeliveryPrefs(bot_module.DELIVERY_DIGEST, 30, None, None, 3))
+    print(f"Сводка с двумя строками одного действия: отправлено {pipeline.sent - sent}, ошибок {pipeline.failed - failed}")
+    assert (pipeline.sent - sent, pipeline.failed - failed) == (1, 0), "сводка с повтором действия не доставлена"
+
+
+class Menus:
+    # Обработчики, которые bot.register_views() зарегистрировал бы в discord.py
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.views = {menu: view_class(catalog) for menu, view_class in bot_module.MENU_VIEWS.items()}
+
+
+async def main(args):
+    fake = FakeDiscord(args.latency)
+    bot_module.bot.get_user = fake.get_user
+    bot_module.LOG_STDOUT_LEVEL = logging.CRITICAL + 1
+
+    bot_module.init_db()
+    bot_module.load_settings_from_db()
+    await bot_module.load_data_from_db()
+    bot_module.dm_pipeline.start()
+    event_log_task = asyncio.create_task(bot_module.event_log.run())
+
+    guild = FakeGuild(1)
+    menus = Menus(bot_module.get_catalog(guild.id))
+
+    if args.memory:
+        tracemalloc.start()
+        check_timer_memory(args)
+    await check_countdown_ticker(fake, guild, menus)
+    await check_digest_duplicates(fake)
+
+    # Пропускную способность обработчиков меряем без входных лимитов, их — отдельным флудом
+    allow_request = bot_module.allow_request
+    bot_module.allow_request = lambda user_id, channel_id=None: True
+
+    scenarios = [
+        await scenario_countdowns(fake, args, menus, bot_module.TIMER_MODE_LIVE),
+        await scenario_countdowns(fake, args, menus, bot_module.TIMER_MODE_RELATIVE),
+        await scenario_clicks(fake, args, guild, menus),
+        await scenario_bulk(fake, args, guild, menus),
+        await scenario_timers(fake, args, guild, menus),
+        await scenario_custom(fake, args, guild, menus),
+        await scenario_messages(fake, args, guild, menus),
+        await scenario_expiry(fake, args),
+    ]
+    bot_module.allow_request = allow_request
+    calls_before = sum(fake.calls.values())
+    scenarios.append(await scenario_flood(fake, args, guild, menus))
+    flood_calls = sum(fake.calls.values()) - calls_before
+
+    for scenario in scenarios:
+        print(scenario.report())
+
+    print("Вызовы API: " + ", ".join(f"{route} {count}" for route, count in fake.calls.most_common()))
+    print("Ожидания по лимитам (429): " + (", ".join(
+        f"{route} {count}" for route, count in fake.rate_limited.most_common()
+    ) or "нет"))
+    print(f"Вызовов API во время флуда: {flood_calls}")
+    print(f"Таймеров в памяти: {len(bot_module.timer_store)}, правок отсчётов: {bot_module.countdown_ticker.edits}")
+    if args.memory:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Память Python: {current / 2 ** 20:.1f} МБ сейчас, пик {peak / 2 ** 20:.1f} МБ")
+    print(f"Пиковый RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+
+    event_log_task.cancel()
+    bot_module.event_log.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота без Discord")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--clicks", type=int, default=5, help="нажатий на игрока")
+    parser.add_argument("--expiring", type=int, default=2000, help="напоминаний с одним сроком")
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременных взаимодействий")
+    parser.add_argument("--latency", type=float, default=0.0, help="средняя задержка REST, секунды")
+    parser.add_argument("--memory", action="store_true", help="считать память через tracemalloc (медленнее)")
+    parser.add_argument("--memory-timers", type=int, default=200000, help="таймеров в проверке памяти при --memory")
+    parser.add_argument("--viewers", type=int, default=10, help="зрителей живых отсчётов (бюджет правок — 5 в секунду)")
+    parser.add_argument("--countdown-seconds", type=float, default=20.0, help="самый долгий таймер у зрителя")
+    parser.add_argument("--spammers", type=int, default=50, help="игроков во флуде")
+    parser.add_argument("--flood", type=int, default=100, help="запросов на спамера")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # Своя база и копия каталога во временной папке — боевая farm_bot.db не трогается
+    workdir = tempfile.mkdtemp(prefix="farm-bot-loadtest-")
+    shutil.copy(os.path.join(BOT_DIR, "actions.json"), workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, BOT_DIR)
+    import bot as bot_module
+
+    try:
+        asyncio.run(main(args))
+    finally:
+        bot_module.db_writer.close()
+        shutil.rmtree(workdir, ignore_errors=True)